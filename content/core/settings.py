@@ -21,7 +21,8 @@ class Settings(BaseSettings):
     cache_expire_in_seconds: int
     rabbitmq_url: str
     algorithm: str
-    secret_key: str
+    secret_key: str | None = None
+    auth_jwks_url: str | None = None
     enable_tracer: bool
     jaeger_host: str
     jaeger_port: int
@@ -0,0 +1,55 @@
+"""Клиент публичных ключей Auth-сервиса."""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict
+
+import httpx
+import jwt
+
+logger = logging.getLogger(__name__)
+
+
+class JWKSClient:
+    """
+    Кеш публичных ключей Auth-сервиса.
+
+    Ключи держатся в памяти и перезапрашиваются только при встрече незнакомого kid,
+    не чаще чем раз в min_refresh_interval секунд, поэтому проверка токена обходится без сети.
+    """
+
+    def __init__(self, url: str, min_refresh_interval: float = 30, timeout: float = 5) -> None:
+        """Инит."""
+        self.url = url
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.keys: Dict[str, Any] = {}
+        self.refreshed_at = 0.0
+        self.lock = asyncio.Lock()
+
+    async def refresh(self) -> None:
+        """Перезагрузка набора ключей."""
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.get(self.url)
+            response.raise_for_status()
+        jwk_set = jwt.PyJWKSet.from_dict(response.json())
+        self.keys = {key.key_id: key for key in jwk_set.keys}
+        self.refreshed_at = time.monotonic()
+        logger.info("JWKS refreshed, keys: %s", list(self.keys))
+
+    async def get_key(self, kid: str) -> jwt.PyJWK:
+        """Публичный ключ по kid."""
+        if kid not in self.keys:
+            async with self.lock:
+                if kid not in self.keys and time.monotonic() - self.refreshed_at >= self.min_refresh_interval:
+                    await self.refresh()
+        if kid not in self.keys:
+            raise jwt.InvalidKeyError(f"Unknown key id: {kid}")
+        return self.keys[kid]
+
+    async def decode(self, token: str, algorithms: list[str]) -> Dict:
+        """Проверка подписи токена локально."""
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = await self.get_key(kid)
+        return jwt.decode(token, key.key, algorithms=algorithms)
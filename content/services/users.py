@@ -4,9 +4,11 @@ import uuid
 
 import jwt
 from fastapi import HTTPException, Request
-from jose.exceptions import ExpiredSignatureError
 
 from core.settings import settings
+from services.jwks import JWKSClient
+
+jwks_client = JWKSClient(settings.auth_jwks_url) if settings.auth_jwks_url else None
 
 
 class UserService:
@@ -17,9 +19,12 @@ class UserService:
         """Достаём id из токена."""
         try:
             token = request.headers["authorization"].split(" ")[1]
-            payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+            if jwks_client:
+                payload = await jwks_client.decode(token, algorithms=[settings.algorithm])
+            else:
+                payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
             id = payload.get("sub")
-        except ExpiredSignatureError:
+        except jwt.ExpiredSignatureError:
             raise HTTPException(status_code=401, detail="Истек срок действия токена")
         except Exception:
             raise HTTPException(status_code=401, detail="Некорретный токен")
@@ -0,0 +1,39 @@
+"""Login history partition management
+
+Revision ID: 5e2b7c9d1a04
+Revises: bb370f044d6f
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+from db.partitions import DEFAULT_PARTITION, PARENT_TABLE, partition_manager
+
+# revision identifiers, used by Alembic.
+revision: str = "5e2b7c9d1a04"
+down_revision: Union[str, None] = "bb370f044d6f"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    partition_manager.ensure(op.get_bind())
+
+
+def downgrade() -> None:
+    connection = op.get_bind()
+    result = connection.execute(
+        sa.text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = :parent AND child.relname LIKE :pattern"
+        ),
+        {"parent": PARENT_TABLE, "pattern": f"{PARENT_TABLE}\\_p%"},
+    )
+    for (name,) in result.all():
+        op.execute(sa.text(f'DROP TABLE "{name}"'))
+    op.execute(sa.text(f'DROP TABLE IF EXISTS "{DEFAULT_PARTITION}"'))
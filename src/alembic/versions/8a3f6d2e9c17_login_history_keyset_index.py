@@ -0,0 +1,29 @@
+"""Login history keyset index
+
+Revision ID: 8a3f6d2e9c17
+Revises: 5e2b7c9d1a04
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "8a3f6d2e9c17"
+down_revision: Union[str, None] = "5e2b7c9d1a04"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Индекс на партиционированной таблице создаётся и на всех её партициях
+    op.create_index(
+        "ix_login_history_user_id_created_at_id", "login_history", ["user_id", "created_at", "id"], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_login_history_user_id_created_at_id", table_name="login_history")
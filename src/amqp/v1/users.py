@@ -2,28 +2,43 @@
 
 import logging
 import uuid
-from typing import Dict, Union
+from typing import Dict, List, Union
 
 from fastapi import Depends
 
 from broker.rabbitmq import exch
 from broker.rabbitmq import rabbit_router as rabbit_users_router
 from exceptions.users import UserNotFound
-from models.entity import User
-from schemas.entity import UserRoleSchema
+from schemas.entity import USER_BATCH_MAX_SIZE, UserBatchSchema, UserRoleSchema
 from services.users import UserService, get_user_service
 
 logger = logging.getLogger(__name__)
 
 
 @rabbit_users_router.subscriber("me", exch, response_model=UserRoleSchema)
-async def get_me(message: uuid.UUID, user_service: UserService = Depends(get_user_service)) -> Union[Dict, User]:
-    """Получение пользователя из токена и не только."""
+async def get_me(
+    message: uuid.UUID, user_service: UserService = Depends(get_user_service)
+) -> Union[Dict, UserRoleSchema]:
+    """Получение пользователя из токена и не только; ответ из кеша пользователя."""
     try:
-        return await user_service.get_user_by_id(user_id=message)
+        return await user_service.get_me(user_id=message)
     except UserNotFound as e:
         logger.error(e)
         return {"status_code": 404, "detail": str(e)}
     except Exception as e:
         logger.error(e)
         return {"status_code": 400, "detail": str(e)}
+
+
+@rabbit_users_router.subscriber("users", exch, response_model=UserBatchSchema)
+async def get_users(
+    message: List[uuid.UUID], user_service: UserService = Depends(get_user_service)
+) -> Union[Dict, UserBatchSchema]:
+    """Пользователи с ролями по списку id одним сообщением вместо me на каждого."""
+    if len(message) > USER_BATCH_MAX_SIZE:
+        return {"status_code": 400, "detail": f"Too many ids, max {USER_BATCH_MAX_SIZE}"}
+    try:
+        return await user_service.get_users(user_ids=message)
+    except Exception as e:
+        logger.error(e)
+        return {"status_code": 400, "detail": str(e)}
@@ -0,0 +1,15 @@
+"""Публичные ключи подписи токенов."""
+from typing import Dict
+
+from fastapi import APIRouter, Response
+
+from utils.keys import key_ring
+
+router = APIRouter()
+
+
+@router.get("/.well-known/jwks.json", summary="JSON Web Key Set")
+async def jwks(response: Response) -> Dict:
+    """Публичные ключи для локальной проверки токенов в других сервисах."""
+    response.headers["Cache-Control"] = "public, max-age=300"
+    return key_ring.jwks()
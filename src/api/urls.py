@@ -4,6 +4,7 @@ from fastapi import APIRouter, Depends
 
 from utils.auth import get_current_user_global
 
+from .jwks import router as jwks_router
 from .v1.auth import router as v1_auth_router
 from .v1.roles import router as v1_roles_router
 from .v1.sections import router as v1_section_router
@@ -11,6 +12,7 @@ from .v1.users import router as v1_users_router
 
 router = APIRouter()
 
+router.include_router(jwks_router, tags=["JWKS"])
 router.include_router(v1_auth_router, tags=["Auth"], prefix="/v1/auth")
 router.include_router(
     v1_roles_router, tags=["Roles"], prefix="/v1/roles", dependencies=[Depends(get_current_user_global)]
@@ -3,8 +3,7 @@ from http import HTTPStatus
 
 from fastapi import APIRouter, Depends, Request
 
-from models.entity import User
-from schemas.entity import RefreshSchema, TokenSchema, UserCreate, UserInDB, UserLoginSchema
+from schemas.entity import RefreshSchema, TokenSchema, UserCreate, UserInDB, UserLoginSchema, UserPrincipalSchema
 from schemas.social import SocialAuthorizationLink, SocialEnum
 from services.auth import AuthService, SocialService, get_auth_service, get_social_service
 from services.users import UserService, get_user_service
@@ -39,7 +38,7 @@ async def refresh(
 async def logout(
     request: Request,
     auth_service: AuthService = Depends(get_auth_service),
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipalSchema = Depends(get_current_user),
 ):
     """Логаут."""
     return await auth_service.logout(request=request, current_user=current_user)
@@ -49,7 +48,7 @@ async def logout(
 async def logout_all(
     request: Request,
     auth_service: AuthService = Depends(get_auth_service),
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipalSchema = Depends(get_current_user),
 ):
     """Выйти из всех устройств."""
     return await auth_service.logout_all(request=request, current_user=current_user)
@@ -3,7 +3,7 @@
 import uuid
 from typing import List
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 
 from models.entity import User
 from schemas.entity import (
@@ -12,11 +12,12 @@ from schemas.entity import (
     RoleCreateSchema,
     RoleUserPatchSchema,
     RoleViewSchema,
+    UserPrincipalSchema,
     UserRoleEnum,
 )
 from services.roles import RoleService, get_role_service
 from services.users import UserService, get_user_service
-from utils.auth import AuthRequest, get_current_user, roles_required
+from utils.auth import AuthRequest, get_current_user, get_current_user_entity, roles_required
 
 router = APIRouter()
 
@@ -26,7 +27,7 @@ router = APIRouter()
 async def create_role(
     payload: RoleCreateSchema,
     request: AuthRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipalSchema = Depends(get_current_user),
     role_service: RoleService = Depends(get_role_service),
 ) -> RoleViewSchema:
     """Создание роли."""
@@ -37,7 +38,7 @@ async def create_role(
 @roles_required(roles_list=[UserRoleEnum.admin])
 async def get_roles(
     request: AuthRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipalSchema = Depends(get_current_user),
     role_service: RoleService = Depends(get_role_service),
 ) -> List[RoleViewSchema]:
     """Список ролей."""
@@ -49,7 +50,7 @@ async def get_roles(
 async def check_role(
     role_name: str,
     request: AuthRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipalSchema = Depends(get_current_user),
     user_service: UserService = Depends(get_user_service),
 ) -> CheckRoleResponse:
     """Проверка роли."""
@@ -61,7 +62,7 @@ async def check_role(
 async def patch_users_role(
     request: AuthRequest,
     payload: RoleUserPatchSchema,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_user_entity),
     user_service: UserService = Depends(get_user_service),
 ) -> None:
     """Назначить/убрать роль пользователю."""
@@ -71,19 +72,29 @@ async def patch_users_role(
 @router.get("/permissions", summary="Check permission", response_model=PermissionUserSchema)
 async def check_permission(
     section_name: str,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipalSchema = Depends(get_current_user),
     user_service: UserService = Depends(get_user_service),
 ) -> PermissionUserSchema:
     """Проверка пермишена."""
     return await user_service.check_permission(user=current_user, section_name=section_name)
 
 
+@router.get("/permissions/batch", summary="Check permissions", response_model=List[PermissionUserSchema])
+async def check_permissions(
+    section_names: List[str] = Query(min_length=1, description="Разделы или all для всех разделов"),
+    current_user: UserPrincipalSchema = Depends(get_current_user),
+    user_service: UserService = Depends(get_user_service),
+) -> List[PermissionUserSchema]:
+    """Проверка пермишенов по нескольким разделам."""
+    return await user_service.check_permissions(user=current_user, section_names=section_names)
+
+
 @router.get("/{role_id}", summary="Get role", response_model=RoleViewSchema)
 @roles_required(roles_list=[UserRoleEnum.admin])
 async def get_role(
     request: AuthRequest,
     role_id: uuid.UUID,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipalSchema = Depends(get_current_user),
     role_service: RoleService = Depends(get_role_service),
 ) -> RoleViewSchema:
     """Получение роли."""
@@ -96,7 +107,7 @@ async def patch_role(
     request: AuthRequest,
     role_id: uuid.UUID,
     payload: RoleCreateSchema,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipalSchema = Depends(get_current_user),
     role_service: RoleService = Depends(get_role_service),
 ) -> RoleViewSchema:
     """Обновление роли."""
@@ -108,7 +119,7 @@ async def patch_role(
 async def delete_role(
     request: AuthRequest,
     role_id: uuid.UUID,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipalSchema = Depends(get_current_user),
     role_service: RoleService = Depends(get_role_service),
 ) -> None:
     """Удаление роли."""
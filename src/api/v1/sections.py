@@ -5,8 +5,7 @@ from typing import List
 
 from fastapi import APIRouter, Depends
 
-from models.entity import User
-from schemas.entity import SectionCreateSchema, SectionViewSchema, UserRoleEnum
+from schemas.entity import SectionCreateSchema, SectionViewSchema, UserPrincipalSchema, UserRoleEnum
 from services.sections import SectionService, get_section_service
 from utils.auth import AuthRequest, get_current_user, roles_required
 
@@ -18,7 +17,7 @@ router = APIRouter()
 async def create_section(
     request: AuthRequest,
     payload: SectionCreateSchema,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipalSchema = Depends(get_current_user),
     section_service: SectionService = Depends(get_section_service),
 ) -> SectionViewSchema:
     """Создание раздела."""
@@ -29,7 +28,7 @@ async def create_section(
 @roles_required(roles_list=[UserRoleEnum.admin])
 async def get_sections(
     request: AuthRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipalSchema = Depends(get_current_user),
     section_service: SectionService = Depends(get_section_service),
 ) -> List[SectionViewSchema]:
     """Получение разделов."""
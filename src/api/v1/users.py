@@ -1,12 +1,26 @@
 """Пользователи."""
 
-from fastapi import APIRouter, Depends
-from fastapi_pagination import Page, paginate
+from datetime import datetime
+from typing import Literal, Optional
 
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from db.postgres import get_sessions
 from models.entity import User
-from schemas.entity import LoginHistorySchema, UserInDB, UserPatchSchema
+from schemas.entity import (
+    LoginHistoryPageSchema,
+    UserBatchRequestSchema,
+    UserBatchSchema,
+    UserInDB,
+    UserPatchSchema,
+    UserPrincipalSchema,
+    UserRoleEnum,
+)
 from services.users import UserService, get_user_service
-from utils.auth import get_current_user
+from utils.auth import AuthRequest, get_current_user, get_current_user_entity, roles_required
+from utils.export import EXPORT_MEDIA_TYPES, export_users
 
 router = APIRouter()
 
@@ -14,18 +28,51 @@ router = APIRouter()
 @router.patch("", summary="Patch user", response_model=UserInDB)
 async def patch_user(
     user_patch: UserPatchSchema,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_user_entity),
     user_service: UserService = Depends(get_user_service),
 ):
     """Патч логина и пароля."""
     return await user_service.patch_user(user=user_patch, current_user=current_user)
 
 
-@router.get("/login_history", summary="Login history", response_model=Page[LoginHistorySchema])
+@router.get("/login_history", summary="Login history", response_model=LoginHistoryPageSchema)
 async def login_history(
-    current_user: User = Depends(get_current_user),
+    cursor: Optional[str] = Query(None, description="next_cursor предыдущей страницы"),
+    size: int = Query(50, ge=1, le=100),
+    date_from: Optional[datetime] = Query(None, description="Начало периода включительно"),
+    date_to: Optional[datetime] = Query(None, description="Конец периода не включительно"),
+    current_user: UserPrincipalSchema = Depends(get_current_user),
+    user_service: UserService = Depends(get_user_service),
+) -> LoginHistoryPageSchema:
+    """История логинов от новых к старым."""
+    return await user_service.login_history(
+        user=current_user, size=size, cursor=cursor, date_from=date_from, date_to=date_to
+    )
+
+
+@router.post("/batch", summary="Get users by ids", response_model=UserBatchSchema)
+@roles_required(roles_list=[UserRoleEnum.admin])
+async def get_users(
+    payload: UserBatchRequestSchema,
+    request: AuthRequest,
+    current_user: UserPrincipalSchema = Depends(get_current_user),
     user_service: UserService = Depends(get_user_service),
-) -> Page[LoginHistorySchema]:
-    """История логинов."""
-    result = await user_service.login_history(user=current_user)
-    return paginate(result)
+) -> UserBatchSchema:
+    """Пользователи с ролями по списку id."""
+    return await user_service.get_users(user_ids=payload.ids)
+
+
+@router.get("/export", summary="Export users", response_class=StreamingResponse)
+@roles_required(roles_list=[UserRoleEnum.admin])
+async def export(
+    request: AuthRequest,
+    fmt: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    sessions: async_sessionmaker = Depends(get_sessions),
+    current_user: UserPrincipalSchema = Depends(get_current_user),
+) -> StreamingResponse:
+    """Выгрузка пользователей с ролями и соцсетями потоком, без загрузки таблицы в память."""
+    return StreamingResponse(
+        export_users(fmt, sessions),
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="users.{fmt}"'},
+    )
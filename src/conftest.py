@@ -14,7 +14,7 @@ from core.config import settings
 from core.config import settings as mocked_settings
 from crud.roles import DBRole
 from crud.users import DBUser
-from db.postgres import get_db
+from db.postgres import get_db, get_primary_sessions, get_sessions
 from db.redis import get_redis
 from main import app
 from models.entity import Role, User
@@ -68,6 +68,8 @@ async def db_fixture():
         # return redis
 
     app.dependency_overrides[get_db] = get_db_override
+    app.dependency_overrides[get_sessions] = lambda: async_session
+    app.dependency_overrides[get_primary_sessions] = lambda: async_session
     app.dependency_overrides[get_redis] = get_redis_override
 
 
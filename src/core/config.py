@@ -1,4 +1,6 @@
 """Настройки."""
+from typing import Dict, List, Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -29,6 +31,48 @@ class Settings(BaseSettings):
     enable_tracer: bool
     jaeger_host: str
     jaeger_port: int
+    stateless_auth: bool = True
+    jwt_keys_dir: Optional[str] = None
+    jwt_active_kid: Optional[str] = None
+    enable_metrics: bool = False
+    metrics_export_interval_ms: int = 60000
+    password_hash_workers: int = 2
+    password_hash_queue_size: int = 64
+    password_hash_method: str = "scrypt:32768:8:1"
+    password_salt_length: int = 16
+    login_history_flush_interval_ms: int = 500
+    login_history_batch_size: int = 500
+    login_history_buffer_size: int = 10000
+    login_history_partition_months: int = 1
+    login_history_partitions_ahead: int = 3
+    login_history_retention_months: int = 0
+    login_history_archive_schema: Optional[str] = None
+    login_history_partition_check_interval_s: int = 3600
+    rate_limit_enabled: bool = True
+    rate_limit_principals: Dict[str, str] = {}
+    rate_limit_routes: Dict[str, str] = {}
+    rate_limit_local_batch: int = 10
+    rate_limit_local_sync_ms: int = 1000
+    redis_max_connections: int = 50
+    redis_pool_timeout: float = 5
+    redis_socket_timeout: float = 5
+    redis_socket_connect_timeout: float = 2
+    redis_health_check_interval: int = 30
+    postgres_pool_size: int = 10
+    postgres_max_overflow: int = 10
+    postgres_pool_recycle: int = 1800
+    postgres_pool_pre_ping: bool = True
+    postgres_pool_timeout: float = 10
+    postgres_prepare_threshold: Optional[int] = 2
+    crud_statement_cache_size: int = 512
+    permission_matrix_max_age_s: float = 60
+    postgres_replica_hosts: List[str] = []
+    postgres_replica_check_interval_s: float = 5
+    postgres_read_your_writes_s: float = 2
+    user_cache_ttl_s: int = 300
+    user_cache_local_ttl_s: float = 2
+    user_cache_local_size: int = 10000
+    export_yield_per: int = 1000
 
     model_config = SettingsConfigDict(
         env_file=(".env"),
@@ -0,0 +1,5 @@
+"""Метрики."""
+from opentelemetry import metrics
+
+# Пока провайдер не сконфигурирован (settings.enable_metrics), инструменты работают вхолостую
+meter = metrics.get_meter("auth-service")
@@ -7,9 +7,10 @@ from http import HTTPStatus
 import typer
 from fastapi import HTTPException
 from sqlalchemy import text
-from werkzeug.security import generate_password_hash
 
+from core.config import settings
 from db.postgres import async_session
+from utils.hashing import hash_password
 
 app = typer.Typer()
 
@@ -17,7 +18,7 @@ app = typer.Typer()
 async def create_admin_task(login: str, first_name: str, last_name: str, password: str):
     """Создание админа метод."""
     async with async_session() as db:
-        password = generate_password_hash(password)
+        password = hash_password(password, settings.password_hash_method, settings.password_salt_length)
         _id = uuid.uuid4()
         query = text(f"SELECT * FROM users WHERE login='{login}'")
         result = await db.execute(query)
@@ -2,19 +2,63 @@
 import logging
 import uuid
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Optional, Tuple, Type, TypeVar, Union
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, List, Optional, Tuple, Type, TypeVar, Union
 
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
-from sqlalchemy import func, or_, select
+from sqlalchemy import Integer, Select, String, bindparam, column, delete, func, insert, or_, select, update, values
 from sqlalchemy.ext.asyncio.session import AsyncSession
 from sqlalchemy.orm import selectinload
 
+from core.config import settings
+
 logger = logging.getLogger(__name__)
 
 ModelType = TypeVar("ModelType", bound=Any)
 CreateUpdateSchemaType = TypeVar("CreateUpdateSchemaType", bound=BaseModel)
 
+# Глубина вложенных unit_of_work в session.info
+UOW_DEPTH_KEY = "unit_of_work_depth"
+
+
+def in_unit_of_work(db: AsyncSession) -> bool:
+    """Открыт ли unit_of_work на сессии."""
+    return db.info.get(UOW_DEPTH_KEY, 0) > 0
+
+
+async def save(db: AsyncSession, *objs: Any) -> None:
+    """Фиксация изменений: внутри unit_of_work - flush, иначе commit и перечитывание объектов."""
+    if in_unit_of_work(db):
+        await db.flush()
+        return
+    await db.commit()
+    for obj in objs:
+        await db.refresh(obj)
+
+
+@asynccontextmanager
+async def unit_of_work(db: AsyncSession) -> AsyncIterator[AsyncSession]:
+    """
+    Группировка записей в одну транзакцию.
+
+    CRUD внутри делает только flush, коммит один при выходе из внешнего блока, при ошибке - откат.
+    Вложенные блоки коммит не делают.
+    """
+    depth = db.info.get(UOW_DEPTH_KEY, 0)
+    db.info[UOW_DEPTH_KEY] = depth + 1
+    try:
+        yield db
+        if not depth:
+            await db.commit()
+    except BaseException:
+        if not depth:
+            await db.rollback()
+        raise
+    finally:
+        db.info[UOW_DEPTH_KEY] = depth
+
 
 class CRUDAbstract(ABC):
     """Абстрактный круд."""
@@ -50,6 +94,66 @@ class CRUDAbstract(ABC):
         pass
 
 
+class StatementCache:
+    """
+    LRU готовых select() по форме вызова геттера.
+
+    Значения уходят в запрос параметрами, поэтому один объект запроса переиспользуется, а его
+    ключ кеша компиляции алхимия считает один раз. Форма без ключа (None) не кешируется.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        """Инит."""
+        self.max_size = max_size
+        self.statements: OrderedDict = OrderedDict()
+
+    def get(self, shape: Optional[Hashable], build: Callable[[], Select]) -> Select:
+        """Запрос из кеша или собранный build."""
+        if shape is None or not self.max_size:
+            return build()
+        statement = self.statements.get(shape)
+        if statement is not None:
+            self.statements.move_to_end(shape)
+            return statement
+        statement = self.statements[shape] = build()
+        if len(self.statements) > self.max_size:
+            self.statements.popitem(last=False)
+        return statement
+
+
+statement_cache = StatementCache(settings.crud_statement_cache_size)
+
+
+def expression_shape(expression: Any) -> Hashable:
+    """Ключ формы SQL-выражения; TypeError, если в выражении зашиты значения."""
+    cache_key = expression._generate_cache_key()
+    if cache_key is None or cache_key.bindparams:
+        raise TypeError("Expression with bound values is not cacheable")
+    return cache_key.key
+
+
+def joins_shape(joins: Optional[List[Tuple]]) -> Tuple:
+    """Ключ формы списка join."""
+    return tuple((table, expression_shape(condition)) for table, condition in joins or [])
+
+
+def statement_shape(parts: Callable[[], Tuple]) -> Optional[Hashable]:
+    """Ключ формы вызова геттера; None - форма не кешируется."""
+    try:
+        shape = parts()
+        hash(shape)
+    except TypeError:
+        return None
+    return shape
+
+
+def condition_clause(key: Any, value: Any, comparison: Callable, name: str) -> Any:
+    """Условие геттера с параметром name; None сравнивается как литерал, то есть через IS (NOT) NULL."""
+    if value is None:
+        return comparison(key, None)
+    return comparison(key, bindparam(name))
+
+
 class CRUDSQLAlchemy:
     """Круд алхимии."""
 
@@ -70,15 +174,19 @@ class CRUDSQLAlchemy:
         condition_any: Optional[List[Dict]] = None,
     ) -> ModelType:
         """Получение сущности."""
-        query = select(_select)
-        if joins:
-            for table, condition in joins:
+        conditions = conditions or []
+        any_items = [item for condition in condition_any or [] for item in condition.items()]
+        params = {"crud_field_value": field_value}
+        params.update({f"crud_condition_{i}": value for i, (_, value, _) in enumerate(conditions) if value is not None})
+        params.update({f"crud_any_{i}": list(value) for i, (_, value) in enumerate(any_items)})
+
+        def build() -> Select:
+            query = select(_select)
+            for table, condition in joins or []:
                 query = query.join(table, condition)
-        if outerjoins:
-            for table, condition in outerjoins:
+            for table, condition in outerjoins or []:
                 query = query.outerjoin(table, condition)
-        if selection_load_options:
-            for options_tuple in selection_load_options:
+            for options_tuple in selection_load_options or []:
                 options_obj = None
                 for option in options_tuple:
                     if options_obj is None:
@@ -87,17 +195,30 @@ class CRUDSQLAlchemy:
                         options_obj = options_obj.selectinload(option)
                 if options_obj:
                     query = query.options(options_obj)
-        if conditions:
-            for key, value, comparison in conditions:
-                query = query.where(comparison(key, value))
-        if condition_any:
-            where_conditions = []
-            for condition in condition_any:
-                for key, value in condition.items():
-                    where_conditions.append(key.in_(value))
-            query = query.where(or_(*where_conditions))
-        query = query.where(field_name == field_value)  # noqa
-        result = await db.execute(query)
+            for i, (key, value, comparison) in enumerate(conditions):
+                query = query.where(condition_clause(key, value, comparison, f"crud_condition_{i}"))
+            if any_items:
+                query = query.where(
+                    or_(*(key.in_(bindparam(f"crud_any_{i}", expanding=True)) for i, (key, _) in enumerate(any_items)))
+                )
+            if field_value is None:
+                return query.where(field_name.is_(None))
+            return query.where(field_name == bindparam("crud_field_value"))  # noqa
+
+        shape = statement_shape(
+            lambda: (
+                "get_by_field_name",
+                _select,
+                field_name,
+                field_value is None,
+                tuple(tuple(options) for options in selection_load_options or []),
+                tuple((key, comparison, value is None) for key, value, comparison in conditions),
+                tuple(key for key, _ in any_items),
+                joins_shape(joins),
+                joins_shape(outerjoins),
+            )
+        )
+        result = await db.execute(statement_cache.get(shape, build), params)
         if outerjoins:
             return result.unique().scalars().first()
         return result.scalars().first()
@@ -115,13 +236,24 @@ class CRUDSQLAlchemy:
         limit: Optional[int] = None,
         offset: Optional[int] = None,
     ) -> List[ModelType]:
-        """Получение списка."""
-        query = select(_select)
-        if joins:
-            for table, condition in joins:
+        """Получение списка; DISTINCT только при joins, остальные условия строк не размножают."""
+        conditions = conditions or []
+        any_items = [item for condition in condition_any or [] for item in condition.items()]
+        search_fields, search_values = search_list or ([], [])
+        params: Dict[str, Any] = {}
+        params.update({f"crud_condition_{i}": value for i, (_, value, _) in enumerate(conditions) if value is not None})
+        params.update({f"crud_any_{i}": list(value) for i, (_, value) in enumerate(any_items)})
+        params.update({f"crud_search_{i}": value for i, value in enumerate(search_values)})
+        if limit:
+            params["crud_limit"] = limit
+        if offset:
+            params["crud_offset"] = offset
+
+        def build() -> Select:
+            query = select(_select)
+            for table, condition in joins or []:
                 query = query.join(table, condition)
-        if selection_load_options:
-            for options_tuple in selection_load_options:
+            for options_tuple in selection_load_options or []:
                 options_obj = None
                 for option in options_tuple:
                     if options_obj is None:
@@ -130,27 +262,41 @@ class CRUDSQLAlchemy:
                         options_obj = options_obj.options(selectinload(option))
                 if options_obj:
                     query = query.options(options_obj)
-        if condition_any:
-            where_conditions = []
-            for condition in condition_any:
-                for key, value in condition.items():
-                    where_conditions.append(key.in_(value))
-            query = query.where(or_(*where_conditions))
-        if conditions:
-            for key, value, comparison in conditions:
-                query = query.where(comparison(key, value))
-        if search_list:
-            for value in search_list[1]:
-                search_conditions_equals = [func.lower(field).contains(value) for field in search_list[0]]
-                query = query.where(or_(*search_conditions_equals))
-        if order is not None:
-            query = query.order_by(order)
-        if limit:
-            query = query.limit(limit=limit)
-        if offset:
-            query = query.offset(offset=offset)
-        query = query.distinct()
-        result = await db.execute(query)
+            if any_items:
+                query = query.where(
+                    or_(*(key.in_(bindparam(f"crud_any_{i}", expanding=True)) for i, (key, _) in enumerate(any_items)))
+                )
+            for i, (key, value, comparison) in enumerate(conditions):
+                query = query.where(condition_clause(key, value, comparison, f"crud_condition_{i}"))
+            for i in range(len(search_values)):
+                value = bindparam(f"crud_search_{i}", type_=String)
+                query = query.where(or_(*(func.lower(field).contains(value) for field in search_fields)))
+            if order is not None:
+                query = query.order_by(order)
+            if limit:
+                query = query.limit(bindparam("crud_limit", type_=Integer))
+            if offset:
+                query = query.offset(bindparam("crud_offset", type_=Integer))
+            if joins:
+                query = query.distinct()
+            return query
+
+        shape = statement_shape(
+            lambda: (
+                "get_list",
+                _select,
+                tuple(tuple(options) for options in selection_load_options or []),
+                tuple(key for key, _ in any_items),
+                tuple((key, comparison, value is None) for key, value, comparison in conditions),
+                joins_shape(joins),
+                tuple(search_fields),
+                len(search_values),
+                expression_shape(order) if order is not None else None,
+                bool(limit),
+                bool(offset),
+            )
+        )
+        result = await db.execute(statement_cache.get(shape, build), params)
         return result.scalars().all()
 
     async def create(self, db: AsyncSession, obj_in: Union[CreateUpdateSchemaType, Dict[str, Any]]) -> ModelType:
@@ -158,8 +304,7 @@ class CRUDSQLAlchemy:
         obj_in = jsonable_encoder(obj_in)
         db_obj = self.model(**obj_in)  # type: ignore
         db.add(db_obj)
-        await db.commit()
-        await db.refresh(db_obj)
+        await save(db, db_obj)
         return db_obj
 
     async def update(
@@ -175,12 +320,54 @@ class CRUDSQLAlchemy:
             if field in update_data:
                 setattr(db_obj, field, update_data[field])
         db.add(db_obj)
-        await db.commit()
-        await db.refresh(db_obj)
+        await save(db, db_obj)
         return db_obj
 
     async def remove(self, db: AsyncSession, _id: Union[int, uuid.UUID]) -> None:
-        """Удаление."""
-        obj = await self.get_by_field_name(db=db, field_name=self.model.id, field_value=_id, _select=self.model)
+        """Удаление; загруженный в сессию объект не перечитывается."""
+        obj = await db.get(self.model, _id)
+        if obj is None:
+            return
         await db.delete(obj)
-        await db.commit()
+        await save(db)
+
+    async def bulk_create(self, db: AsyncSession, rows: List[Dict[str, Any]]) -> List[ModelType]:
+        """Вставка пачкой через INSERT ... RETURNING."""
+        if not rows:
+            return []
+        objs = list((await db.scalars(insert(self.model).returning(self.model), rows)).all())
+        await save(db)
+        return objs
+
+    async def bulk_update(self, db: AsyncSession, rows: List[Dict[str, Any]]) -> int:
+        """
+        Обновление пачкой через UPDATE ... FROM (VALUES ...) по id.
+
+        Во всех строках одинаковый набор полей, включая id. Загруженные в сессию объекты не обновляются.
+        """
+        if not rows:
+            return 0
+        table = self.model.__table__
+        fields = list(rows[0])
+        data = (
+            values(*(column(field, table.c[field].type) for field in fields), name="data")
+            .data([tuple(row[field] for field in fields) for row in rows])
+            .alias("data")
+        )
+        query = (
+            update(self.model)
+            .where(self.model.id == data.c.id)
+            .values({field: data.c[field] for field in fields if field != "id"})
+            .execution_options(synchronize_session=False)
+        )
+        result = await db.execute(query)
+        await save(db)
+        return result.rowcount
+
+    async def bulk_delete(self, db: AsyncSession, ids: List[Union[int, uuid.UUID]]) -> int:
+        """Удаление пачкой через DELETE ... WHERE id IN."""
+        if not ids:
+            return 0
+        result = await db.execute(delete(self.model).where(self.model.id.in_(ids)))
+        await save(db)
+        return result.rowcount
@@ -1,12 +1,54 @@
 """Круд логинов."""
-from crud.base_crud import CRUDSQLAlchemy
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Row, insert, select, tuple_
+from sqlalchemy.ext.asyncio.session import AsyncSession
+
+from crud.base_crud import CRUDSQLAlchemy, save
 from models.entity import LoginHistory
 
 
 class CRUDLoginHistory(CRUDSQLAlchemy):
     """Круд логинов."""
 
-    pass
+    async def bulk_insert(self, db: AsyncSession, rows: List[Dict]) -> None:
+        """Вставка пачки записей одним INSERT ... VALUES."""
+        if not rows:
+            return
+        await db.execute(insert(self.model).values(rows))
+        await save(db)
+
+    async def get_page(
+        self,
+        db: AsyncSession,
+        user_id: uuid.UUID,
+        size: int,
+        after: Optional[Tuple[datetime, uuid.UUID]] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+    ) -> Sequence[Row]:
+        """
+        Страница истории от новых к старым по ключу (created_at, id).
+
+        Возвращает до size + 1 строк: лишняя строка означает, что есть следующая страница.
+        Границы по датам дают Postgres отсечь лишние партиции.
+        """
+        query = (
+            select(self.model.id, self.model.user_agent, self.model.host, self.model.created_at)
+            .where(self.model.user_id == user_id)
+            .order_by(self.model.created_at.desc(), self.model.id.desc())
+            .limit(size + 1)
+        )
+        if after:
+            query = query.where(tuple_(self.model.created_at, self.model.id) < tuple_(*after))
+        if date_from:
+            query = query.where(self.model.created_at >= date_from)
+        if date_to:
+            query = query.where(self.model.created_at < date_to)
+        result = await db.execute(query)
+        return result.all()
 
 
-DBLoginHistory = CRUDSQLAlchemy(LoginHistory)
+DBLoginHistory = CRUDLoginHistory(LoginHistory)
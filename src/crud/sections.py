@@ -1,5 +1,10 @@
 """Круд раздел."""
 
+import uuid
+from typing import Iterable, Set
+
+from sqlalchemy.ext.asyncio.session import AsyncSession
+
 from crud.base_crud import CRUDSQLAlchemy
 from models.entity import Section
 
@@ -7,7 +12,13 @@ from models.entity import Section
 class CRUDSection(CRUDSQLAlchemy):
     """Круд раздел."""
 
-    pass
+    async def get_missing_ids(self, db: AsyncSession, ids: Iterable[uuid.UUID]) -> Set[uuid.UUID]:
+        """Id из списка, которых нет в базе, одним запросом."""
+        ids = set(ids)
+        if not ids:
+            return set()
+        existing = await self.get_list(_select=self.model.id, db=db, condition_any=[{self.model.id: list(ids)}])
+        return ids - set(existing)
 
 
 DBSection = CRUDSection(Section)
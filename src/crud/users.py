@@ -1,13 +1,15 @@
 """Пользователи - круд."""
 
 import uuid
-from typing import Optional
+from typing import AsyncIterator, List, Optional, Sequence
 
-from sqlalchemy import exists, select
+from sqlalchemy import Row, String, any_, bindparam, exists, func, select, update
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
 from sqlalchemy.ext.asyncio.session import AsyncSession
+from sqlalchemy.orm import selectinload
 
-from crud.base_crud import CRUDSQLAlchemy
-from models.entity import Role, SocialNetwork, User
+from crud.base_crud import CRUDSQLAlchemy, save
+from models.entity import Role, SocialNetwork, User, association_table, social_users_table
 
 
 class CRUDUser(CRUDSQLAlchemy):
@@ -25,23 +27,78 @@ class CRUDUser(CRUDSQLAlchemy):
         role_exists = await self.is_role(db=db, role_name="admin", _uuid=_uuid)
         return role_exists
 
+    @staticmethod
+    async def get_ids_by_role(db: AsyncSession, role_id: uuid.UUID) -> List[uuid.UUID]:
+        """Идентификаторы пользователей с ролью."""
+        result = await db.execute(select(association_table.c.user_id).where(association_table.c.role_id == role_id))
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def get_with_roles_by_ids(db: AsyncSession, ids: List[uuid.UUID]) -> List[User]:
+        """Пользователи с ролями по списку id одним запросом id = ANY(:ids)."""
+        query = (
+            select(User)
+            .where(User.id == any_(bindparam("ids", ids, type_=ARRAY(UUID(as_uuid=True)))))
+            .options(selectinload(User.roles))
+        )
+        return list((await db.execute(query)).scalars().all())
+
+    @staticmethod
+    async def stream_export(db: AsyncSession, yield_per: int) -> AsyncIterator[Sequence[Row]]:
+        """
+        Пользователи с именами ролей и соцсетей пачками по yield_per через серверный курсор.
+
+        Роли и соцсети собираются коррелированными подзапросами по ключам связующих таблиц,
+        поэтому выборка не требует GROUP BY по всей таблице и отдаётся по мере чтения.
+        """
+        roles = (
+            select(Role.name)
+            .join(association_table, association_table.c.role_id == Role.id)
+            .where(association_table.c.user_id == User.id)
+            .scalar_subquery()
+        )
+        social = (
+            select(SocialNetwork.name)
+            .join(social_users_table, social_users_table.c.social_id == SocialNetwork.id)
+            .where(social_users_table.c.user_id == User.id)
+            .scalar_subquery()
+        )
+        query = select(
+            User.id,
+            User.login,
+            User.first_name,
+            User.last_name,
+            User.created_at,
+            func.array(roles, type_=ARRAY(String)).label("roles"),
+            func.array(social, type_=ARRAY(String)).label("social"),
+        ).execution_options(yield_per=yield_per)
+        result = await db.stream(query)
+        async for partition in result.partitions():
+            yield partition
+
+    @staticmethod
+    async def set_password(db: AsyncSession, user_id: uuid.UUID, password_hash: str) -> None:
+        """Замена хеша пароля без перезагрузки пользователя."""
+        await db.execute(update(User).where(User.id == user_id).values(password=password_hash))
+        await save(db)
+
     @staticmethod
     async def add_role(db: AsyncSession, role: Role, user: User):
         """Назначить роль."""
         user.roles.append(role)
-        await db.commit()
+        await save(db)
 
     @staticmethod
     async def remove_role(db: AsyncSession, role: Role, user: User):
         """Убрать роль."""
         user.roles.remove(role)
-        await db.commit()
+        await save(db)
 
     @staticmethod
     async def add_social(db: AsyncSession, social: SocialNetwork, user: User):
         """Назначить роль."""
         user.social.append(social)
-        await db.commit()
+        await save(db)
 
 
 DBUser = CRUDUser(User)
@@ -0,0 +1,223 @@
+"""Партиции истории входов."""
+import asyncio
+import logging
+import re
+from datetime import UTC, date, datetime
+from typing import List, NamedTuple, Optional, Union
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from db.postgres import engine
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = "login_history"
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+# Ключ pg_advisory_xact_lock, чтобы воркеры не обслуживали партиции одновременно
+MAINTENANCE_LOCK_KEY = 7_311_240_001
+BOUND_RE = re.compile(r"FROM \((?:'([^']+)'|MINVALUE)\) TO \((?:'([^']+)'|MAXVALUE)\)")
+
+
+class Partition(NamedTuple):
+    """Партиция и её диапазон [start, end); None - открытая граница."""
+
+    name: str
+    start: Optional[datetime]
+    end: Optional[datetime]
+
+
+def add_months(value: date, months: int) -> date:
+    """Сдвиг первого числа месяца на months месяцев."""
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def period_start(value: date, interval_months: int) -> date:
+    """Начало периода партиции, в который попадает дата."""
+    return date(value.year, (value.month - 1) // interval_months * interval_months + 1, 1)
+
+
+def parse_bound(bound: str) -> tuple:
+    """Диапазон партиции из pg_get_expr(relpartbound)."""
+    match = BOUND_RE.search(bound)
+    if not match:
+        return None, None
+    start, end = match.groups()
+    return (
+        datetime.fromisoformat(start) if start else None,
+        datetime.fromisoformat(end) if end else None,
+    )
+
+
+class PartitionManager:
+    """
+    Создание партиций login_history наперёд и удаление старых.
+
+    Партиции нарезаются по interval_months месяцев (1 - помесячно) и создаются на ahead периодов вперёд.
+    Партиция DEFAULT принимает строки, для которых партиции ещё нет; при создании партиции
+    такие строки переносятся в неё. Партиции старше retention_months отсоединяются и удаляются
+    или переносятся в схему archive_schema. Методы принимают синхронное соединение,
+    поэтому работают и в миграциях, и в приложении через run_sync.
+    """
+
+    def __init__(
+        self, interval_months: int, ahead: int, retention_months: int = 0, archive_schema: Optional[str] = None
+    ) -> None:
+        """Инит."""
+        if 12 % interval_months:
+            raise ValueError("Partition interval must divide a year: 1, 2, 3, 4, 6 or 12 months")
+        self.interval_months = interval_months
+        self.ahead = ahead
+        self.retention_months = retention_months
+        self.archive_schema = archive_schema
+
+    def partition_name(self, start: date) -> str:
+        """Имя партиции по началу периода."""
+        return f"{PARENT_TABLE}_p{start:%Y%m}"
+
+    def planned(self, today: date) -> List[Partition]:
+        """Партиции текущего периода и ahead следующих."""
+        first = period_start(today, self.interval_months)
+        partitions = []
+        for step in range(self.ahead + 1):
+            start = add_months(first, step * self.interval_months)
+            end = add_months(start, self.interval_months)
+            partitions.append(
+                Partition(
+                    self.partition_name(start),
+                    datetime.combine(start, datetime.min.time()),
+                    datetime.combine(end, datetime.min.time()),
+                )
+            )
+        return partitions
+
+    @staticmethod
+    def existing(connection: Union[Connection, Session]) -> List[Partition]:
+        """Партиции login_history с диапазонами; у DEFAULT диапазона нет."""
+        result = connection.execute(
+            text(
+                "SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) FROM pg_inherits "
+                "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE parent.relname = :parent ORDER BY child.relname"
+            ),
+            {"parent": PARENT_TABLE},
+        )
+        return [Partition(name, *parse_bound(bound)) for name, bound in result]
+
+    @staticmethod
+    def ensure_default(connection: Union[Connection, Session]) -> None:
+        """Партиция по умолчанию, чтобы вставка не падала без подходящей партиции."""
+        connection.execute(
+            text(f'CREATE TABLE IF NOT EXISTS "{DEFAULT_PARTITION}" PARTITION OF {PARENT_TABLE} DEFAULT')
+        )
+
+    def ensure(self, connection: Union[Connection, Session], today: Optional[date] = None) -> List[str]:
+        """Создание недостающих партиций; возвращает имена созданных."""
+        self.ensure_default(connection)
+        existing = [partition for partition in self.existing(connection) if partition.name != DEFAULT_PARTITION]
+        created = []
+        for partition in self.planned(today or datetime.now(UTC).date()):
+            if any(
+                (other.start is None or other.start < partition.end)
+                and (other.end is None or partition.start < other.end)
+                for other in existing
+            ):
+                continue
+            self.create(connection, partition)
+            existing.append(partition)
+            created.append(partition.name)
+        if created:
+            logger.info("Login history partitions created: %s", created)
+        return created
+
+    @staticmethod
+    def create(connection: Union[Connection, Session], partition: Partition) -> None:
+        """Создание партиции с переносом её строк из DEFAULT."""
+        bounds = {"start": partition.start, "end": partition.end}
+        has_rows = connection.execute(
+            text(
+                f'SELECT EXISTS (SELECT 1 FROM "{DEFAULT_PARTITION}" WHERE created_at >= :start AND created_at < :end)'
+            ),
+            bounds,
+        ).scalar()
+        values = f"FOR VALUES FROM ('{partition.start:%Y-%m-%d %H:%M:%S}') TO ('{partition.end:%Y-%m-%d %H:%M:%S}')"
+        if not has_rows:
+            connection.execute(text(f'CREATE TABLE "{partition.name}" PARTITION OF {PARENT_TABLE} {values}'))
+            return
+        # Postgres не создаст партицию, пока подходящие строки лежат в DEFAULT
+        connection.execute(
+            text(f'CREATE TABLE "{partition.name}" (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        )
+        connection.execute(
+            text(
+                f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" WHERE created_at >= :start AND created_at < :end '
+                f'RETURNING *) INSERT INTO "{partition.name}" SELECT * FROM moved'
+            ),
+            bounds,
+        )
+        connection.execute(text(f'ALTER TABLE {PARENT_TABLE} ATTACH PARTITION "{partition.name}" {values}'))
+
+    def expired(self, connection: Union[Connection, Session], today: date) -> List[Partition]:
+        """Партиции целиком старше срока хранения."""
+        cutoff = add_months(period_start(today, self.interval_months), -self.retention_months)
+        cutoff = datetime.combine(cutoff, datetime.min.time())
+        return [
+            partition
+            for partition in self.existing(connection)
+            if partition.name != DEFAULT_PARTITION and partition.end is not None and partition.end <= cutoff
+        ]
+
+    def apply_retention(self, connection: Union[Connection, Session], today: Optional[date] = None) -> List[str]:
+        """Отсоединение и удаление или архивация старых партиций; возвращает их имена."""
+        if not self.retention_months:
+            return []
+        removed = []
+        for partition in self.expired(connection, today or datetime.now(UTC).date()):
+            connection.execute(text(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION "{partition.name}"'))
+            if self.archive_schema:
+                connection.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{self.archive_schema}"'))
+                connection.execute(text(f'ALTER TABLE "{partition.name}" SET SCHEMA "{self.archive_schema}"'))
+            else:
+                connection.execute(text(f'DROP TABLE "{partition.name}"'))
+            removed.append(partition.name)
+        if removed:
+            logger.info(
+                "Login history partitions %s: %s",
+                f"archived to {self.archive_schema}" if self.archive_schema else "dropped",
+                removed,
+            )
+        return removed
+
+    def maintain(self, connection: Union[Connection, Session], today: Optional[date] = None) -> None:
+        """Создание и удаление партиций под advisory-блокировкой."""
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MAINTENANCE_LOCK_KEY})
+        self.ensure(connection, today)
+        self.apply_retention(connection, today)
+
+
+partition_manager = PartitionManager(
+    interval_months=settings.login_history_partition_months,
+    ahead=settings.login_history_partitions_ahead,
+    retention_months=settings.login_history_retention_months,
+    archive_schema=settings.login_history_archive_schema,
+)
+
+
+async def maintain_partitions() -> None:
+    """Обслуживание партиций в одной транзакции."""
+    async with engine.begin() as connection:
+        await connection.run_sync(partition_manager.maintain)
+
+
+async def partition_maintenance_loop(interval: float) -> None:
+    """Периодическое обслуживание партиций."""
+    while True:
+        try:
+            await maintain_partitions()
+        except Exception:
+            logger.exception("Login history partition maintenance failed")
+        await asyncio.sleep(interval)
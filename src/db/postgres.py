@@ -1,23 +1,250 @@
 """Постгрес."""
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Hashable, List, Optional
 
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+from opentelemetry.metrics import CallbackOptions, Observation
+from sqlalchemy import Select, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.sql.dml import UpdateBase
 
 from core.config import settings
+from core.metrics import meter
+
+logger = logging.getLogger(__name__)
+
+# Ключи session.info: сессия писала и дальше читает из основной базы; закреплённая реплика;
+# пользователь запроса для окна read-your-writes
+WROTE_KEY = "wrote_to_primary"
+REPLICA_KEY = "replica"
+PRINCIPAL_KEY = "principal_id"
+
+pool_checkout_wait = meter.create_histogram(
+    "auth.postgres.pool.checkout_wait", unit="ms", description="Ожидание соединения из пула постгреса"
+)
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Пул соединений с замером ожидания соединения."""
+
+    def _do_get(self):
+        """Соединение из пула; ожидание, включая открытие нового соединения, пишется в метрику."""
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_checkout_wait.record((time.perf_counter() - start) * 1000)
+
 
 # Создаём базовый класс для будущих моделей
 Base = declarative_base()
+
+
+def make_dsn(host: str) -> str:
+    """DSN базы на хосте host."""
+    return f"postgresql+psycopg://{settings.postgres_user}:{settings.postgres_password}@{host}/{settings.postgres_db}"
+
+
+def make_engine(host: str) -> AsyncEngine:
+    """Движок с общими настройками пула."""
+    return create_async_engine(
+        make_dsn(host),
+        future=True,
+        echo=settings.echo,
+        poolclass=TimedQueuePool,
+        pool_size=settings.postgres_pool_size,
+        max_overflow=settings.postgres_max_overflow,
+        pool_recycle=settings.postgres_pool_recycle,
+        pool_pre_ping=settings.postgres_pool_pre_ping,
+        pool_timeout=settings.postgres_pool_timeout,
+        # psycopg готовит запрос на сервере после prepare_threshold выполнений на соединении,
+        # повторяющиеся выборки по полю дальше идут без разбора и планирования; None отключает
+        connect_args={"prepare_threshold": settings.postgres_prepare_threshold},
+    )
+
+
 # Создаём движок
 # Настройки подключения к БД передаём из переменных окружения, которые заранее загружены в файл настроек
-dsn = (
-    f"postgresql+psycopg://{settings.postgres_user}:{settings.postgres_password}@{settings.postgres_host}/"
-    f"{settings.postgres_db}"
+dsn = make_dsn(settings.postgres_host)
+engine = make_engine(settings.postgres_host)
+
+
+class ReplicaRouter:
+    """
+    Выбор реплики для чтения.
+
+    Сессия закрепляется за одной репликой из здоровых, реплики раздаются сессиям по кругу;
+    проверка SELECT 1 раз в check_interval секунд. После записи пользователя его чтения
+    read_your_writes секунд идут в основную базу, чтобы следующий запрос увидел свои изменения,
+    пока реплика догоняет.
+    """
+
+    def __init__(self, hosts: List[str], check_interval: float, read_your_writes: float) -> None:
+        """Инит."""
+        self.engines = {host: make_engine(host) for host in hosts}
+        self.healthy = list(self.engines.values())
+        self.check_interval = check_interval
+        self.read_your_writes = read_your_writes
+        self.cycle = itertools.count()
+        # Время последней записи по пользователю; порядок вставки совпадает с порядком времени
+        self.writers: OrderedDict[Hashable, float] = OrderedDict()
+        self.checker: Optional[asyncio.Task] = None
+
+    def mark_write(self, principal: Optional[Hashable]) -> None:
+        """Начало окна чтения из основной базы для пользователя."""
+        if principal is None or not self.engines:
+            return
+        now = time.monotonic()
+        self.writers.pop(principal, None)
+        self.writers[principal] = now
+        while self.writers:
+            oldest, written_at = next(iter(self.writers.items()))
+            if now - written_at < self.read_your_writes:
+                break
+            del self.writers[oldest]
+
+    def recently_wrote(self, principal: Optional[Hashable]) -> bool:
+        """Пользователь писал в пределах окна read_your_writes."""
+        written_at = self.writers.get(principal) if principal is not None else None
+        return written_at is not None and time.monotonic() - written_at < self.read_your_writes
+
+    def choose(self, current: Optional[AsyncEngine] = None) -> Optional[AsyncEngine]:
+        """Реплика для чтения: закреплённая current, пока она здорова, иначе следующая; None - основная база."""
+        healthy = self.healthy
+        if not healthy:
+            return None
+        if current is not None and current in healthy:
+            return current
+        return healthy[next(self.cycle) % len(healthy)]
+
+    async def is_alive(self, replica: AsyncEngine) -> bool:
+        """Проверка реплики."""
+        try:
+            async with asyncio.timeout(self.check_interval):
+                async with replica.connect() as connection:
+                    await connection.execute(text("SELECT 1"))
+        except Exception:
+            return False
+        return True
+
+    async def check(self) -> None:
+        """Обновление списка здоровых реплик."""
+        alive = await asyncio.gather(*(self.is_alive(replica) for replica in self.engines.values()))
+        healthy = [replica for replica, ok in zip(self.engines.values(), alive) if ok]
+        down = [host for host, ok in zip(self.engines, alive) if not ok]
+        if down:
+            logger.warning("Postgres replicas unavailable, reads fall back: %s", down)
+        self.healthy = healthy
+
+    async def run(self) -> None:
+        """Периодическая проверка реплик."""
+        while True:
+            await self.check()
+            await asyncio.sleep(self.check_interval)
+
+    def start(self) -> None:
+        """Запуск проверки реплик."""
+        if self.engines:
+            self.checker = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Остановка проверки и закрытие пулов реплик."""
+        if self.checker is not None:
+            self.checker.cancel()
+            self.checker = None
+        for replica in self.engines.values():
+            await replica.dispose()
+
+
+replica_router = ReplicaRouter(
+    hosts=settings.postgres_replica_hosts,
+    check_interval=settings.postgres_replica_check_interval_s,
+    read_your_writes=settings.postgres_read_your_writes_s,
+)
+
+
+class RoutingSession(Session):
+    """
+    Сессия с чтением из реплик.
+
+    В реплику, закреплённую за сессией, уходят только SELECT без FOR UPDATE. Flush и DML помечают
+    сессию и пользователя запроса писавшими, после этого их чтения идут в основную базу.
+    Прочие запросы (text, соединение без запроса) идут в основную базу, не считаясь записью.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        """Движок для запроса."""
+        principal = self.info.get(PRINCIPAL_KEY)
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info[WROTE_KEY] = True
+            replica_router.mark_write(principal)
+            return engine.sync_engine
+        if (
+            not self.info.get(WROTE_KEY)
+            and isinstance(clause, Select)
+            and clause._for_update_arg is None
+            and not replica_router.recently_wrote(principal)
+        ):
+            replica = replica_router.choose(self.info.get(REPLICA_KEY))
+            if replica is not None:
+                self.info[REPLICA_KEY] = replica
+                return replica.sync_engine
+        return engine.sync_engine
+
+
+def bind_principal(db: AsyncSession, principal_id: Hashable) -> None:
+    """Пользователь запроса, к которому относится окно read-your-writes сессии."""
+    db.info[PRINCIPAL_KEY] = principal_id
+
+
+# Сессия запроса: чтения по репликам, записи в основную базу
+async_session = async_sessionmaker(
+    engine, class_=AsyncSession, sync_session_class=RoutingSession, expire_on_commit=False
+)
+# Сессия только основной базы - фоновые записи и чтения, которым нельзя отставать
+primary_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+def observe_checked_out(options: CallbackOptions) -> List[Observation]:
+    """Соединения, выданные из пула."""
+    return [
+        Observation(pool_engine.pool.checkedout(), {"host": host})
+        for host, pool_engine in {settings.postgres_host: engine, **replica_router.engines}.items()
+    ]
+
+
+def observe_idle(options: CallbackOptions) -> List[Observation]:
+    """Свободные соединения в пуле."""
+    return [
+        Observation(pool_engine.pool.checkedin(), {"host": host})
+        for host, pool_engine in {settings.postgres_host: engine, **replica_router.engines}.items()
+    ]
+
+
+meter.create_observable_gauge(
+    "auth.postgres.pool.checked_out", callbacks=[observe_checked_out], description="Занятые соединения постгреса"
+)
+meter.create_observable_gauge(
+    "auth.postgres.pool.idle", callbacks=[observe_idle], description="Свободные соединения постгреса"
 )
-engine = create_async_engine(dsn, future=True, echo=settings.echo)
-async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)  # noqa
 
 
 async def get_db():
     """Подключение к постгрес."""
     async with async_session() as session:
         yield session
+
+
+def get_sessions() -> async_sessionmaker:
+    """Фабрика сессий с чтением из реплик для работы, которая переживает зависимости запроса."""
+    return async_session
+
+
+def get_primary_sessions() -> async_sessionmaker:
+    """Фабрика сессий основной базы для чтений, которым нельзя отставать от записи."""
+    return primary_session
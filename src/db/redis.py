@@ -1,18 +1,107 @@
 """Интерфейс доступа к редис."""
+import time
+import weakref
+from typing import List, Optional
 
-from redis.asyncio import Redis
+from opentelemetry.metrics import CallbackOptions, Observation
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.commands.core import AsyncScript
 
 from core.config import settings
+from core.metrics import meter
 
-# redis: Optional[Redis] = None
+redis: Optional[Redis] = None
+
+pool_wait = meter.create_histogram(
+    "auth.redis.pool.wait", unit="ms", description="Ожидание свободного соединения из пула редиса"
+)
+pools: "weakref.WeakSet[InstrumentedConnectionPool]" = weakref.WeakSet()
+
+
+class InstrumentedConnectionPool(BlockingConnectionPool):
+    """Пул соединений редиса с замером ожидания соединения."""
+
+    async def get_connection(self, command_name, *keys, **options):
+        """Соединение из пула; ожидание пишется в метрику."""
+        start = time.perf_counter()
+        try:
+            return await super().get_connection(command_name, *keys, **options)
+        finally:
+            pool_wait.record((time.perf_counter() - start) * 1000, {"db": self.connection_kwargs.get("db", 0)})
+
+
+def observe_in_use(options: CallbackOptions) -> List[Observation]:
+    """Занятые соединения по пулам."""
+    return [Observation(len(pool._in_use_connections), {"db": pool.connection_kwargs.get("db", 0)}) for pool in pools]
+
+
+def observe_idle(options: CallbackOptions) -> List[Observation]:
+    """Свободные соединения по пулам."""
+    return [
+        Observation(len(pool._available_connections), {"db": pool.connection_kwargs.get("db", 0)}) for pool in pools
+    ]
+
+
+meter.create_observable_gauge(
+    "auth.redis.pool.in_use", callbacks=[observe_in_use], description="Занятые соединения пула редиса"
+)
+meter.create_observable_gauge(
+    "auth.redis.pool.idle", callbacks=[observe_idle], description="Свободные соединения пула редиса"
+)
+
+
+def create_redis(db: int) -> Redis:
+    """Клиент редиса на общем пуле соединений; закрытие клиента закрывает пул."""
+    pool = InstrumentedConnectionPool(
+        host=settings.redis_host,
+        port=settings.redis_port,
+        db=db,
+        max_connections=settings.redis_max_connections,
+        timeout=settings.redis_pool_timeout,
+        socket_timeout=settings.redis_socket_timeout,
+        socket_connect_timeout=settings.redis_socket_connect_timeout,
+        health_check_interval=settings.redis_health_check_interval,
+    )
+    pools.add(pool)
+    return Redis.from_pool(pool)
+
+
+def register_script(script: str) -> AsyncScript:
+    """
+    Lua-скрипт с SHA, посчитанным один раз при импорте.
+
+    Скрипт не привязан к клиенту: вызывается с client=... и идёт через EVALSHA, SCRIPT LOAD - только
+    если сервер его ещё не знает.
+    """
+    return AsyncScript(None, script.encode())
+
+
+async def init_redis() -> Redis:
+    """Создание общего клиента при старте приложения."""
+    global redis
+    redis = create_redis(db=0)
+    return redis
+
+
+async def close_redis() -> None:
+    """Закрытие общего клиента и его пула."""
+    global redis
+    if redis is not None:
+        await redis.aclose()
+    redis = None
 
 
 async def get_redis() -> Redis:
     """
     Внедрение зависимостей для ручек.
 
+    Отдаёт общий клиент из lifespan; без lifespan (скрипты, тесты) - клиент на время запроса.
+
     :return: Redis
     """
+    if redis is not None:
+        yield redis
+        return
     r = Redis(host=settings.redis_host, port=settings.redis_port, db=0)
     try:
         yield r
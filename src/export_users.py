@@ -0,0 +1,48 @@
+"""Выгрузка пользователей."""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+import typer
+
+from core.config import settings
+from db.postgres import async_session, engine, replica_router
+from utils.export import EXPORT_MEDIA_TYPES, export_users
+
+app = typer.Typer()
+
+
+async def export_task(fmt: str, output: Optional[Path], yield_per: int) -> None:
+    """Запись выгрузки кусками по мере чтения курсора."""
+    started = time.monotonic()
+    written = 0
+    target = output.open("w", encoding="utf-8", newline="") if output else sys.stdout
+    try:
+        async for chunk in export_users(fmt, async_session, yield_per=yield_per):
+            target.write(chunk)
+            written += len(chunk)
+    finally:
+        if output:
+            target.close()
+        await replica_router.stop()
+        await engine.dispose()
+    typer.echo(f"Exported {written} characters in {time.monotonic() - started:.1f}s", err=True)
+
+
+@app.command()
+def run(
+    fmt: str = typer.Option("ndjson", "--format", help="ndjson или csv"),
+    output: Optional[Path] = typer.Option(None, help="Файл выгрузки; по умолчанию stdout"),
+    yield_per: int = typer.Option(settings.export_yield_per, min=1, help="Строк в одной пачке курсора"),
+):
+    """Выгрузка пользователей с ролями и соцсетями через серверный курсор."""
+    if fmt not in EXPORT_MEDIA_TYPES:
+        raise typer.BadParameter("ndjson или csv", param_hint="--format")
+    asyncio.run(export_task(fmt, output, yield_per))
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,50 @@
+"""Бенчмарк политики хеширования паролей."""
+
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import typer
+
+from core.config import settings
+from utils.hashing import get_policy_method, hash_password
+
+app = typer.Typer()
+
+
+def hash_for(method: str, salt_length: int, seconds: float) -> int:
+    """Количество хешей за отведённое время в одном процессе."""
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        hash_password("benchmark-password", method, salt_length)
+        count += 1
+    return count
+
+
+@app.command()
+def benchmark(
+    methods: Optional[List[str]] = typer.Option(None, "--method", help="Метод werkzeug, например pbkdf2:sha256:600000"),
+    seconds: float = typer.Option(3.0, help="Длительность замера для каждого метода"),
+    processes: int = typer.Option(multiprocessing.cpu_count(), help="Количество процессов"),
+):
+    """Хешей в секунду на ядро для текущей политики и кандидатов."""
+    methods = methods or [settings.password_hash_method]
+    typer.echo(f"current policy: {get_policy_method(settings.password_hash_method)}, processes: {processes}")
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+        for method in methods:
+            counts = list(
+                executor.map(
+                    hash_for, [method] * processes, [settings.password_salt_length] * processes, [seconds] * processes
+                )
+            )
+            total = sum(counts) / seconds
+            typer.echo(
+                f"{get_policy_method(method)}: {total / processes:.1f} hashes/s per core, "
+                f"{total:.1f} hashes/s total, {1000 * processes / total:.1f} ms per hash"
+            )
+
+
+if __name__ == "__main__":
+    app()
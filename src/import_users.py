@@ -0,0 +1,348 @@
+"""Массовый импорт пользователей."""
+
+import asyncio
+import csv
+import json
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import typer
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from core.config import settings
+from db.postgres import engine
+from utils.hashing import hash_passwords
+
+app = typer.Typer()
+
+STAGING_TABLE = "import_users"
+STAGING_COLUMNS = ("seq", "id", "login", "password", "first_name", "last_name", "roles")
+CREATE_STAGING = text(
+    f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (seq bigint, id uuid, login varchar(255), "
+    "password varchar(255), first_name varchar(50), last_name varchar(50), roles text[]) ON COMMIT DELETE ROWS"
+)
+COPY_STAGING = f"COPY {STAGING_TABLE} ({', '.join(STAGING_COLUMNS)}) FROM STDIN"
+# Внутри пачки повторный логин побеждает последним; xmax = 0 - строка вставлена, а не обновлена
+UPSERT = """
+WITH latest AS (
+    SELECT DISTINCT ON (login) * FROM {staging} ORDER BY login, seq DESC
+), upserted AS (
+    INSERT INTO users (id, login, password, first_name, last_name, created_at)
+    SELECT id, login, password, first_name, last_name, timezone('utc', now()) FROM latest
+    ON CONFLICT (login) {on_conflict}
+    RETURNING id, login, xmax = 0 AS created
+), granted AS (
+    INSERT INTO userrole (user_id, role_id)
+    SELECT upserted.id, roles.id FROM upserted
+    JOIN latest ON latest.login = upserted.login
+    JOIN roles ON roles.name = ANY(latest.roles)
+    ON CONFLICT DO NOTHING
+    RETURNING 1
+)
+SELECT count(*) FILTER (WHERE created), count(*) FILTER (WHERE NOT created), (SELECT count(*) FROM granted)
+FROM upserted
+"""
+# Строковые поля записи и их предельная длина по колонкам users; None - без ограничения
+FIELD_LIMITS = {"login": 255, "password": None, "password_hash": 255, "first_name": 50, "last_name": 50}
+ON_CONFLICT = {
+    "skip": "DO NOTHING",
+    "update": (
+        "DO UPDATE SET password = COALESCE(EXCLUDED.password, users.password), "
+        "first_name = COALESCE(EXCLUDED.first_name, users.first_name), "
+        "last_name = COALESCE(EXCLUDED.last_name, users.last_name)"
+    ),
+}
+
+
+@dataclass
+class Record:
+    """Строка импорта."""
+
+    seq: int
+    login: str
+    password: Optional[str]
+    password_hash: Optional[str]
+    first_name: Optional[str]
+    last_name: Optional[str]
+    roles: List[str]
+
+
+@dataclass
+class Progress:
+    """
+    Счётчики импорта; records - сколько записей источника обработано и закоммичено.
+
+    records = created + updated + skipped + duplicates + rejected, где duplicates - повторы логина
+    внутри пачки, схлопнутые до последней записи.
+    """
+
+    source: str
+    records: int = 0
+    created: int = 0
+    updated: int = 0
+    skipped: int = 0
+    duplicates: int = 0
+    rejected: int = 0
+    roles_granted: int = 0
+
+    def save(self, path: Path) -> None:
+        """Атомарная запись чекпоинта."""
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(json.dumps(asdict(self)))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path, source: str) -> "Progress":
+        """Чекпоинт прошлого запуска по тому же источнику или новый прогресс."""
+        if not path.exists():
+            return cls(source=source)
+        progress = cls(**json.loads(path.read_text()))
+        if progress.source != source:
+            raise typer.BadParameter(f"Чекпоинт {path} относится к {progress.source}", param_hint="--checkpoint")
+        return progress
+
+
+def read_rows(path: Path, fmt: str) -> Iterator[Tuple[int, Optional[Dict], str]]:
+    """Строки CSV с заголовком или NDJSON по одной: (номер строки файла, запись, ошибка разбора)."""
+    if fmt == "csv":
+        with path.open(newline="", encoding="utf-8") as source:
+            reader = csv.DictReader(source)
+            while True:
+                try:
+                    row = next(reader)
+                except StopIteration:
+                    return
+                except csv.Error as e:
+                    yield reader.line_num, None, f"malformed CSV: {e}"
+                    continue
+                yield reader.line_num, row, ""
+    # NDJSON читается байтами: неверная кодировка отклоняет одну строку, а не весь файл
+    with path.open("rb") as source:
+        for line_num, line in enumerate(source, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_num, json.loads(line), ""
+            except ValueError as e:
+                yield line_num, None, f"malformed JSON: {e}"
+
+
+def parse_roles(value) -> List[str]:
+    """Роли списком из NDJSON или через запятую из CSV."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [role.strip() for role in value if role.strip()]
+
+
+def to_record(seq: int, row, default_roles: List[str], known_roles: Set[str]) -> Tuple[Optional[Record], str]:
+    """Проверка строки; при ошибке возвращается причина."""
+    if not isinstance(row, dict):
+        return None, "record is not an object"
+    for field, max_length in FIELD_LIMITS.items():
+        value = row.get(field)
+        if value is not None and not isinstance(value, str):
+            return None, f"{field} is not a string"
+        if max_length and len(value or "") > max_length:
+            return None, f"{field} is longer than {max_length}"
+    login = (row.get("login") or "").strip()
+    if not login:
+        return None, "login is empty"
+    raw_roles = row.get("roles")
+    if not isinstance(raw_roles, (str, list, type(None))) or (
+        isinstance(raw_roles, list) and not all(isinstance(role, str) for role in raw_roles)
+    ):
+        return None, "roles is not a string or a list of strings"
+    roles = parse_roles(raw_roles) or default_roles
+    unknown = set(roles) - known_roles
+    if unknown:
+        return None, f"unknown roles {sorted(unknown)}"
+    return (
+        Record(
+            seq=seq,
+            login=login,
+            password=row.get("password") or None,
+            password_hash=row.get("password_hash") or None,
+            first_name=row.get("first_name") or None,
+            last_name=row.get("last_name") or None,
+            roles=roles,
+        ),
+        "",
+    )
+
+
+def read_batches(
+    path: Path, fmt: str, skip: int, batch_size: int, default_roles: List[str], known_roles: Set[str]
+) -> Iterator[Tuple[int, List[Record], int]]:
+    """Пачки записей после первых skip: (записей источника в пачке, годные записи, отклонённые)."""
+    batch: List[Record] = []
+    consumed = rejected = 0
+    for seq, (line_num, row, error) in enumerate(read_rows(path, fmt)):
+        if seq < skip:
+            continue
+        consumed += 1
+        record, error = (None, error) if error else to_record(seq, row, default_roles, known_roles)
+        if record is None:
+            rejected += 1
+            typer.echo(f"Record {seq + 1} (line {line_num}) rejected: {error}", err=True)
+        else:
+            batch.append(record)
+        if consumed == batch_size:
+            yield consumed, batch, rejected
+            batch, consumed, rejected = [], 0, 0
+    if consumed:
+        yield consumed, batch, rejected
+
+
+async def hash_batch(executor: ProcessPoolExecutor, chunks: int, records: List[Record]) -> List[Record]:
+    """Хеширование открытых паролей пачки в пуле процессов; готовые password_hash не трогаются."""
+    pending = [record for record in records if record.password and not record.password_hash]
+    if pending:
+        loop = asyncio.get_running_loop()
+        parts = [pending[i::chunks] for i in range(min(chunks, len(pending)))]
+        hashed = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    executor,
+                    hash_passwords,
+                    [record.password for record in part],
+                    settings.password_hash_method,
+                    settings.password_salt_length,
+                )
+                for part in parts
+            )
+        )
+        for part, hashes in zip(parts, hashed):
+            for record, password_hash in zip(part, hashes):
+                record.password_hash = password_hash
+    return records
+
+
+async def write_batch(connection: AsyncConnection, records: List[Record], on_conflict: str) -> Tuple[int, int, int]:
+    """COPY пачки во временную таблицу и перенос в users и userrole одной транзакцией."""
+    driver_connection = (await connection.get_raw_connection()).driver_connection
+    async with driver_connection.cursor() as cursor:
+        async with cursor.copy(COPY_STAGING) as copy:
+            for record in records:
+                await copy.write_row(
+                    (
+                        record.seq,
+                        uuid.uuid4(),
+                        record.login,
+                        record.password_hash,
+                        record.first_name,
+                        record.last_name,
+                        record.roles,
+                    )
+                )
+    result = await connection.execute(text(UPSERT.format(staging=STAGING_TABLE, on_conflict=ON_CONFLICT[on_conflict])))
+    created, updated, granted = result.one()
+    await connection.commit()
+    return created, updated, granted
+
+
+async def import_task(
+    path: Path, fmt: str, batch_size: int, workers: int, roles: List[str], on_conflict: str, checkpoint: Path
+) -> Progress:
+    """Импорт с хешированием следующей пачки, пока пишется текущая."""
+    progress = Progress.load(checkpoint, str(path.resolve()))
+    if progress.records:
+        typer.echo(f"Resuming after {progress.records} records")
+    started = time.monotonic()
+    imported_before = progress.records
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        async with engine.connect() as connection:
+            await connection.execute(CREATE_STAGING)
+            known_roles = set((await connection.execute(text("SELECT name FROM roles"))).scalars().all())
+            await connection.commit()
+            unknown = set(roles) - known_roles
+            if unknown:
+                raise typer.BadParameter(f"Unknown roles: {sorted(unknown)}", param_hint="--role")
+
+            batches = read_batches(path, fmt, progress.records, batch_size, roles, known_roles)
+
+            def schedule() -> Optional[Tuple[asyncio.Future, int, int]]:
+                batch = next(batches, None)
+                if batch is None:
+                    return None
+                consumed, records, rejected = batch
+                return asyncio.ensure_future(hash_batch(executor, workers * 4, records)), consumed, rejected
+
+            current = schedule()
+            while current is not None:
+                hashing, consumed, rejected = current
+                records = await hashing
+                current = schedule()
+                created, updated, granted = await write_batch(connection, records, on_conflict)
+                progress.records += consumed
+                progress.created += created
+                progress.updated += updated
+                logins = len({record.login for record in records})
+                progress.skipped += logins - created - updated
+                progress.duplicates += len(records) - logins
+                progress.rejected += rejected
+                progress.roles_granted += granted
+                progress.save(checkpoint)
+                elapsed = time.monotonic() - started
+                typer.echo(
+                    f"{progress.records} records: {progress.created} created, {progress.updated} updated, "
+                    f"{progress.skipped} skipped, {progress.duplicates} duplicates, {progress.rejected} rejected; "
+                    f"{(progress.records - imported_before) / elapsed:.0f} records/s"
+                )
+    finally:
+        executor.shutdown(cancel_futures=True)
+        await engine.dispose()
+    return progress
+
+
+@app.command()
+def run(
+    path: Path = typer.Argument(..., exists=True, dir_okay=False, help="CSV с заголовком или NDJSON"),
+    fmt: Optional[str] = typer.Option(None, "--format", help="csv или ndjson; по умолчанию по расширению"),
+    batch_size: int = typer.Option(5000, min=1, help="Записей в одном COPY и одной транзакции"),
+    workers: int = typer.Option(os.cpu_count() or 1, min=1, help="Процессов для хеширования паролей"),
+    role: List[str] = typer.Option(["user"], help="Роли для записей без своего поля roles"),
+    on_conflict: str = typer.Option(
+        "skip",
+        help=(
+            "skip - оставить существующий логин как есть, без ролей из файла; "
+            "update - обновить заданные в файле поля и добавить роли"
+        ),
+    ),
+    checkpoint: Optional[Path] = typer.Option(None, help="Файл прогресса; по умолчанию <path>.checkpoint"),
+):
+    """
+    Импорт пользователей: поля login, password или password_hash, first_name, last_name, roles.
+
+    Повторы логина внутри пачки схлопываются до последней записи. Существующим пользователям роли
+    из файла добавляются только с --on-conflict update; имеющиеся роли не отзываются.
+
+    После каждой пачки прогресс пишется в чекпоинт; повторный запуск с тем же файлом продолжает
+    с первой незакоммиченной записи. Пачка, закоммиченная до падения, но не попавшая в чекпоинт,
+    повторяется и пропускается по конфликту логина.
+    """
+    fmt = fmt or ("csv" if path.suffix.lower() == ".csv" else "ndjson")
+    if fmt not in ("csv", "ndjson"):
+        raise typer.BadParameter("Формат csv или ndjson", param_hint="--format")
+    if on_conflict not in ON_CONFLICT:
+        raise typer.BadParameter("skip или update", param_hint="--on-conflict")
+    checkpoint = checkpoint or path.with_name(path.name + ".checkpoint")
+    progress = asyncio.run(import_task(path, fmt, batch_size, workers, role, on_conflict, checkpoint))
+    typer.echo(
+        f"Done: {progress.records} records, {progress.created} created, {progress.updated} updated, "
+        f"{progress.skipped} skipped, {progress.duplicates} duplicates, {progress.rejected} rejected, "
+        f"{progress.roles_granted} roles granted"
+    )
+
+
+if __name__ == "__main__":
+    app()
@@ -1,13 +1,17 @@
 """Мэйн."""
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from logging.config import dictConfig
 
 from fastapi import FastAPI, Request, status
 from fastapi.responses import ORJSONResponse
 from fastapi_pagination import add_pagination
-from opentelemetry import trace
+from opentelemetry import metrics, trace
 from opentelemetry.exporter.jaeger.thrift import JaegerExporter
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import ConsoleMetricExporter, PeriodicExportingMetricReader
 from opentelemetry.sdk.resources import SERVICE_NAME, Resource
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
@@ -17,6 +21,12 @@ from api.urls import router
 from broker.rabbitmq import rabbit_router
 from core.config import settings
 from core.logger import LOGGING
+from db.partitions import partition_maintenance_loop
+from db.postgres import replica_router
+from db.redis import close_redis, create_redis, init_redis
+from utils.hashing import password_hasher
+from utils.login_history import login_history_writer
+from utils.permissions import permission_matrix
 from utils.rate_limiter import rate_limiter
 
 
@@ -53,15 +63,59 @@ def configure_tracer() -> None:
     trace.get_tracer_provider().add_span_processor(BatchSpanProcessor(ConsoleSpanExporter()))
 
 
+def configure_meter() -> None:
+    """Конфигурирование метрик."""
+    resource = Resource(attributes={SERVICE_NAME: "auth-service"})
+    reader = PeriodicExportingMetricReader(
+        ConsoleMetricExporter(), export_interval_millis=settings.metrics_export_interval_ms
+    )
+    metrics.set_meter_provider(MeterProvider(resource=resource, metric_readers=[reader]))
+
+
 if settings.enable_tracer:
     configure_tracer()
 
+if settings.enable_metrics:
+    configure_meter()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Запуск и остановка ресурсов приложения."""
+    cache = await init_redis()
+    replica_router.start()
+    password_hasher.start()
+    login_history_writer.start()
+    if settings.rate_limit_enabled:
+        rate_limiter.start(create_redis(db=1))
+    await permission_matrix.start(cache)
+    partition_task = None
+    if settings.login_history_partition_check_interval_s > 0:
+        partition_task = asyncio.create_task(
+            partition_maintenance_loop(settings.login_history_partition_check_interval_s)
+        )
+    yield
+    if partition_task:
+        partition_task.cancel()
+        # Дожидаемся выхода из транзакции с advisory lock до закрытия пулов
+        try:
+            await partition_task
+        except asyncio.CancelledError:
+            pass
+    await permission_matrix.stop()
+    await login_history_writer.stop()
+    await rate_limiter.stop()
+    await close_redis()
+    await replica_router.stop()
+    password_hasher.shutdown()
+
 
 app = FastAPI(
     title=settings.project_name,
     docs_url="/api/auth/openapi",
     openapi_url="/api/auth/openapi.json",
     default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 if settings.enable_tracer:
@@ -70,22 +124,26 @@ if settings.enable_tracer:
 
 @app.middleware("http")
 async def before_request(request: Request, call_next):
-    """Чек хедеров: request-id."""
-    response = await call_next(request)
+    """Чек хедеров: request-id. Ограничение частоты запросов до вызова ручки."""
     request_id = request.headers.get("X-Request-Id")
-
-    user = request.headers.get("X-Forwarded-For")
-    result = rate_limiter(user)
-    if result:
-        return ORJSONResponse(status_code=status.HTTP_429_TOO_MANY_REQUESTS, content={"detail": "Too many requests"})
-
     if not request_id:
         return ORJSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"detail": "X-Request-Id is required"})
 
+    limit = await rate_limiter.limit(request)
+    if limit and not limit.allowed:
+        return ORJSONResponse(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            content={"detail": "Too many requests"},
+            headers=limit.headers(),
+        )
+
     tracer = trace.get_tracer(__name__)
     span = tracer.start_span("auth")
     span.set_attribute("http.request_id", request_id)
     span.end()
+    response = await call_next(request)
+    if limit:
+        response.headers.update(limit.headers())
     return response
 
 
@@ -0,0 +1,67 @@
+"""Обслуживание партиций истории входов."""
+
+import asyncio
+from typing import Optional
+
+import typer
+
+from core.config import settings
+from db.partitions import DEFAULT_PARTITION, PartitionManager
+from db.postgres import engine
+
+app = typer.Typer()
+
+
+async def run(manager: PartitionManager, method: str) -> None:
+    """Вызов метода менеджера в одной транзакции."""
+    async with engine.begin() as connection:
+        result = await connection.run_sync(getattr(manager, method))
+    await engine.dispose()
+    if isinstance(result, list):
+        for item in result:
+            typer.echo(item)
+
+
+@app.command()
+def create(
+    ahead: int = typer.Option(settings.login_history_partitions_ahead, help="Сколько периодов создать наперёд"),
+    months: int = typer.Option(settings.login_history_partition_months, help="Длина периода в месяцах"),
+):
+    """Создание партиций на текущий и следующие периоды."""
+    asyncio.run(run(PartitionManager(interval_months=months, ahead=ahead), "ensure"))
+
+
+@app.command()
+def retention(
+    keep: int = typer.Option(settings.login_history_retention_months, help="Срок хранения в месяцах"),
+    archive_schema: Optional[str] = typer.Option(
+        settings.login_history_archive_schema, help="Схема для архива вместо удаления"
+    ),
+    months: int = typer.Option(settings.login_history_partition_months, help="Длина периода в месяцах"),
+):
+    """Отсоединение и удаление или архивация старых партиций."""
+    if keep <= 0:
+        raise typer.BadParameter("Срок хранения должен быть больше нуля", param_hint="--keep")
+    manager = PartitionManager(interval_months=months, ahead=0, retention_months=keep, archive_schema=archive_schema)
+    asyncio.run(run(manager, "apply_retention"))
+
+
+@app.command()
+def show():
+    """Список партиций с диапазонами."""
+
+    async def show_task():
+        async with engine.connect() as connection:
+            partitions = await connection.run_sync(PartitionManager.existing)
+        await engine.dispose()
+        for partition in partitions:
+            if partition.name == DEFAULT_PARTITION:
+                typer.echo(f"{partition.name}\tDEFAULT")
+            else:
+                typer.echo(f"{partition.name}\t{partition.start}\t{partition.end}")
+
+    asyncio.run(show_task())
+
+
+if __name__ == "__main__":
+    app()
@@ -3,11 +3,13 @@ import uuid
 from datetime import UTC, datetime
 from typing import Optional
 
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, String, Table, UniqueConstraint, text
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Index, String, Table, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from werkzeug.security import check_password_hash, generate_password_hash
 
+from core.config import settings
+from db.partitions import partition_manager
 from db.postgres import Base
 
 association_table = Table(
@@ -27,18 +29,7 @@ social_users_table = Table(
 
 def create_partition(target, connection, **kw):
     """Партицирование историй входа."""
-    connection.execute(
-        text(
-            "CREATE TABLE login_history_y2024 PARTITION OF login_history FOR VALUES FROM ('2024-01-01 00:00:00') "
-            "TO ('2025-01-01 00:00:00') PARTITION BY RANGE (created_at)"
-        )
-    )
-    connection.execute(
-        text(
-            "CREATE TABLE login_history_y2025 PARTITION OF login_history FOR VALUES FROM ('2025-01-01 00:00:00') "
-            "TO ('2026-01-01 00:00:00') PARTITION BY RANGE (created_at)"
-        )
-    )
+    partition_manager.ensure(connection)
 
 
 class User(Base):
@@ -57,11 +48,22 @@ class User(Base):
     login_history = relationship("LoginHistory", cascade="all, delete", back_populates="user")
     social = relationship("SocialNetwork", cascade="all, delete", back_populates="users", secondary=social_users_table)
 
-    def __init__(self, login: str, first_name: str, last_name: str, password: Optional[str] = None) -> None:
-        """Инит."""
+    def __init__(
+        self,
+        login: str,
+        first_name: str,
+        last_name: str,
+        password: Optional[str] = None,
+        password_hash: Optional[str] = None,
+    ) -> None:
+        """Инит. Сервисы передают готовый password_hash, посчитанный в пуле процессов."""
         self.login = login
-        if password:
-            self.password = self.password = generate_password_hash(password)
+        if password_hash:
+            self.password = password_hash
+        elif password:
+            self.password = generate_password_hash(
+                password, method=settings.password_hash_method, salt_length=settings.password_salt_length
+            )
         self.first_name = first_name
         self.last_name = last_name
 
@@ -121,6 +123,7 @@ class LoginHistory(Base):
     __tablename__ = "login_history"
     __table_args__ = (
         UniqueConstraint("id", "created_at"),
+        Index("ix_login_history_user_id_created_at_id", "user_id", "created_at", "id"),
         {"postgresql_partition_by": "RANGE (created_at)", "listeners": [("after_create", create_partition)]},
     )
 
@@ -128,7 +131,7 @@ class LoginHistory(Base):
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=True)
     user_agent = Column(String(250), nullable=True)
     host = Column(String(250), nullable=True)
-    created_at = Column(DateTime, default=datetime.now(UTC), index=True, primary_key=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(UTC), index=True, primary_key=True)
 
     user = relationship("User", back_populates="login_history", cascade="all, delete", uselist=False)
 
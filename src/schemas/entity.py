@@ -5,7 +5,10 @@ from enum import Enum
 from typing import List, Optional
 from uuid import UUID
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
+
+# Предел id в одном пакетном запросе пользователей
+USER_BATCH_MAX_SIZE = 500
 
 
 class UserCreate(BaseModel):
@@ -129,6 +132,14 @@ class LoginHistorySchema(BaseModel):
     created_at: datetime
 
 
+class LoginHistoryPageSchema(BaseModel):
+    """Страница истории логинов."""
+
+    items: List[LoginHistorySchema]
+    size: int
+    next_cursor: Optional[str] = None
+
+
 class CheckRoleResponse(BaseModel):
     """Проверка роли."""
 
@@ -157,6 +168,29 @@ class UserRoleSchema(BaseModel):
     roles: Optional[List[RoleSimpleSchema]] = None
 
 
+class UserBatchRequestSchema(BaseModel):
+    """Список id пользователей."""
+
+    ids: List[UUID] = Field(min_length=1, max_length=USER_BATCH_MAX_SIZE)
+
+
+class UserBatchSchema(BaseModel):
+    """Пользователи с ролями по списку id."""
+
+    items: List[UserRoleSchema]
+    missing: List[UUID] = []
+
+
+class UserPrincipalSchema(BaseModel):
+    """Аутентифицированный пользователь, собранный из подписанных клеймов токена."""
+
+    model_config = ConfigDict(from_attributes=True)
+
+    id: UUID
+    roles: List[RoleSimpleSchema] = []
+    sid: Optional[str] = None
+
+
 class UserRoleEnum(str, Enum):
     """Енам ролей."""
 
@@ -1,63 +1,150 @@
 """Сервисы авторизации."""
+import json
 import logging
-import operator
+import uuid
 from functools import lru_cache
 from http import HTTPStatus
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import httpx
 from fastapi import Depends, HTTPException, Request
-from jose import JWTError, jwt
+from jose import JWTError
 from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio.session import AsyncSession
 
 from core.config import settings
-from crud.login_history import DBLoginHistory
+from crud.base_crud import unit_of_work
 from crud.roles import DBRole
 from crud.social import DBSocial
 from crud.users import DBUser
 from db.postgres import get_db
-from db.redis import get_redis
-from models.entity import LoginHistory, Role, SocialNetwork, User
-from schemas.entity import RefreshSchema, TokenSchema, UserLoginSchema
+from db.redis import get_redis, register_script
+from models.entity import Role, SocialNetwork, User
+from schemas.entity import RefreshSchema, RoleSimpleSchema, TokenSchema, UserLoginSchema, UserPrincipalSchema
 from schemas.social import SocialAuthorizationLink, SocialEnum
 from services.base import AbstractService, SocialAbstractService
-from utils.auth import create_access_token, create_refresh_token
+from utils.auth import (
+    SESSION_GENERATION_KEY,
+    TOKEN_VERSION_KEY,
+    create_access_token,
+    create_refresh_token,
+    new_session_id,
+)
+from utils.hashing import password_hasher
+from utils.keys import decode_jwt
+from utils.login_history import login_history_writer
 
 logger = logging.getLogger(__name__)
 
+ROTATION_REJECTED = -1
+ROTATION_STALE_ROLES = 0
+ROTATION_OK = 1
+
+# KEYS: хеш сессий пользователя, поколение сессий, версия токенов.
+# ARGV: sid, предъявленный токен, новый токен, TTL поля, поколение из токена, роли (JSON) или "".
+# Возвращает {-1} при отказе, {0, ver}, если роли сессии устарели и их надо передать заново,
+# {1, ver, roles} после ротации.
+ROTATE_REFRESH_TOKEN_SCRIPT = """
+local generation = tonumber(redis.call('GET', KEYS[2]) or '0')
+if generation ~= tonumber(ARGV[5]) then
+    return {-1, 0}
+end
+local raw = redis.call('HGET', KEYS[1], ARGV[1])
+if not raw or string.sub(raw, 1, 1) ~= '{' then
+    return {-1, 0}
+end
+local entry = cjson.decode(raw)
+if entry['token'] ~= ARGV[2] then
+    return {-1, 0}
+end
+local version = tonumber(redis.call('GET', KEYS[3]) or '0')
+if ARGV[6] ~= '' then
+    entry['roles'] = cjson.decode(ARGV[6])
+    entry['ver'] = version
+elseif tonumber(entry['ver']) ~= version then
+    return {0, version}
+end
+entry['token'] = ARGV[3]
+redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(entry))
+redis.call('HEXPIRE', KEYS[1], ARGV[4], 'FIELDS', 1, ARGV[1])
+return {1, version, cjson.encode(entry['roles'])}
+"""
+
+rotate_refresh_token_script = register_script(ROTATE_REFRESH_TOKEN_SCRIPT)
+
+
+def dump_roles(roles: List[Union[Role, RoleSimpleSchema]]) -> List[List[str]]:
+    """Роли сессии в виде пар [id, name]."""
+    return [[str(role.id), role.name] for role in roles]
+
 
 class AuthService(AbstractService):
     """Сервис авторизации."""
 
-    @staticmethod
-    async def get_id_from_token(request: Request) -> str:
-        """Получение первичного ключа из токена."""
-        token = request.headers["authorization"].split(" ")[1]
-        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
-        return payload.get("sub")
-
-    @staticmethod
-    async def get_nested_key(login_history: LoginHistory) -> str:
-        """Формирование ключа вложенной хеш структуры."""
-        return login_history.user_agent + login_history.host + str(login_history.user_id)
-
-    async def hget_from_cache(self, user_id: str, nested_key: str) -> str:
-        """Получение значений из хеш структуры."""
-        return await self.cache.hget(name=user_id, key=nested_key)
-
-    async def hset_to_cache(
-        self, user_id: str, nested_key: str, refresh_token: str, nx: bool, xx: bool, gt: bool, lt: bool
+    async def get_session_state(self, user_id: Any) -> Tuple[int, int]:
+        """Версия токенов и поколение сессий пользователя за один запрос к редису."""
+        pipe = self.cache.pipeline(transaction=False)
+        pipe.get(TOKEN_VERSION_KEY.format(user_id=user_id))
+        pipe.get(SESSION_GENERATION_KEY.format(user_id=user_id))
+        token_version, generation = await pipe.execute()
+        return int(token_version or 0), int(generation or 0)
+
+    async def store_refresh_token(
+        self,
+        user_id: str,
+        session_id: str,
+        refresh_token: str,
+        roles: List[Union[Role, RoleSimpleSchema]],
+        token_version: int,
     ) -> None:
-        """Запись значений в хеш структуру."""
-        await self.cache.hset(name=user_id, mapping={nested_key: refresh_token})
-        await self.cache.hexpire(
-            user_id, settings.refresh_token_expire_minutes * 60, nested_key, nx=nx, xx=xx, gt=gt, lt=lt
+        """Запись сессии в поле sid хеша пользователя со своим TTL: рефреш токен и роли для рефреша."""
+        entry = json.dumps({"token": refresh_token, "roles": dump_roles(roles), "ver": token_version})
+        pipe = self.cache.pipeline(transaction=True)
+        pipe.hset(name=user_id, key=session_id, value=entry)
+        pipe.hexpire(user_id, settings.refresh_token_expire_minutes * 60, session_id)
+        await pipe.execute()
+
+    async def create_session(self, user_id: Any, roles: List[Union[Role, RoleSimpleSchema]]) -> TokenSchema:
+        """Выпуск пары токенов для новой сессии."""
+        token_version, generation = await self.get_session_state(user_id)
+        session_id = new_session_id()
+        access_token = create_access_token(
+            subject=user_id, roles=roles, token_version=token_version, session_id=session_id
         )
-
-    async def hdel(self, user_id: str, keys: List[str]) -> None:
-        """Удаление ключей хеш структуры."""
-        await self.cache.hdel(user_id, *keys)
+        refresh_token = create_refresh_token(subject=user_id, session_id=session_id, generation=generation)
+        await self.store_refresh_token(
+            user_id=str(user_id),
+            session_id=session_id,
+            refresh_token=refresh_token,
+            roles=roles,
+            token_version=token_version,
+        )
+        return TokenSchema(access_token=access_token, refresh_token=refresh_token)
+
+    async def rotate_refresh_token(
+        self, payload_token: Dict, old_token: str, new_token: str, roles: Optional[List] = None
+    ) -> Tuple[int, int, List]:
+        """Вызов скрипта ротации; возвращает статус, версию токенов и роли сессии."""
+        user_id = payload_token["sub"]
+        result = await rotate_refresh_token_script(
+            client=self.cache,
+            keys=[
+                user_id,
+                SESSION_GENERATION_KEY.format(user_id=user_id),
+                TOKEN_VERSION_KEY.format(user_id=user_id),
+            ],
+            args=[
+                payload_token["sid"],
+                old_token,
+                new_token,
+                settings.refresh_token_expire_minutes * 60,
+                payload_token.get("gen", 0),
+                json.dumps(roles) if roles is not None else "",
+            ],
+        )
+        status, token_version = int(result[0]), int(result[1])
+        roles = json.loads(result[2]) if len(result) > 2 else []
+        return status, token_version, roles or []
 
     async def login(self, payload: UserLoginSchema, request: Request) -> TokenSchema:
         """Логин."""
@@ -70,115 +157,89 @@ class AuthService(AbstractService):
         )
         if not user:
             raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail="Неверный логин или пароль")
-        if not user.check_password(payload.password):
+        is_valid, new_password_hash = await password_hasher.verify_and_update(user.password, payload.password)
+        if not is_valid:
             raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail="Неверный логин или пароль")
-        login_history = await DBLoginHistory.create(
+        if new_password_hash:
+            await DBUser.set_password(db=self.db, user_id=user.id, password_hash=new_password_hash)
+        await login_history_writer.write(
             db=self.db,
-            obj_in={
-                "user_id": user.id,
-                "user_agent": request.headers.get("user-agent"),
-                "host": request.headers.get("host"),
-            },
-        )
-        role_ids = [str(el.id) for el in user.roles]
-        access_token = create_access_token(subject=user.id, role_ids=role_ids)
-        refresh_token = create_refresh_token(subject=user.id)
-        nested_key = await self.get_nested_key(login_history)
-        await self.hset_to_cache(
-            user_id=str(user.id),
-            nested_key=nested_key,
-            refresh_token=refresh_token,
-            nx=True,
-            xx=False,
-            gt=False,
-            lt=False,
-        )
-
-        return TokenSchema(
-            access_token=access_token,
-            refresh_token=refresh_token,
+            user_id=user.id,
+            user_agent=request.headers.get("user-agent"),
+            host=request.headers.get("host"),
         )
+        return await self.create_session(user_id=user.id, roles=user.roles)
 
     async def refresh(self, payload: RefreshSchema, request: Request) -> TokenSchema:
-        """Рефреш."""
+        """
+        Рефреш.
+
+        Проверка и ротация рефреш токена - один вызов Lua скрипта, который возвращает роли сессии.
+        В базу идём, только если роли пользователя поменялись после выдачи сессии.
+        """
         try:
-            payload_token = jwt.decode(payload.refresh_token, settings.secret_key, algorithms=[settings.algorithm])
+            payload_token = decode_jwt(payload.refresh_token)
         except JWTError:
             raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail="Ошибка авторизации")
-        user = await DBUser.get_by_field_name(
-            db=self.db,
-            field_value=payload_token.get("sub"),
-            field_name=User.id,
-            _select=User,
-        )
-        login_history = await DBLoginHistory.create(
-            db=self.db,
-            obj_in={
-                "user_id": user.id,
-                "user_agent": request.headers.get("user-agent"),
-                "host": request.headers.get("host"),
-            },
-        )
-
-        nested_key = await self.get_nested_key(login_history)
-
-        old_token = await self.hget_from_cache(user_id=str(user.id), nested_key=nested_key)
-        if not old_token or old_token.decode() != payload.refresh_token:
-            raise HTTPException(status_code=HTTPStatus.FORBIDDEN, detail="Ошибка вайтлиста токенов")
-
-        access_token = create_access_token(subject=user.id, role_ids=[1])
-        refresh_token = create_refresh_token(subject=user.id)
+        if payload_token.get("type") != "refresh" or not payload_token.get("sid") or not payload_token.get("sub"):
+            raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail="Ошибка авторизации")
 
-        await self.hset_to_cache(
-            user_id=str(user.id),
-            nested_key=nested_key,
-            refresh_token=refresh_token,
-            nx=False,
-            xx=True,
-            gt=False,
-            lt=False,
+        user_id = payload_token["sub"]
+        refresh_token = create_refresh_token(
+            subject=user_id, session_id=payload_token["sid"], generation=payload_token.get("gen", 0)
         )
-
-        # Роли пока заглушка
-        return TokenSchema(
-            access_token=access_token,
-            refresh_token=refresh_token,
+        status, token_version, roles = await self.rotate_refresh_token(
+            payload_token=payload_token, old_token=payload.refresh_token, new_token=refresh_token
         )
+        if status == ROTATION_STALE_ROLES:
+            user = await DBUser.get_by_field_name(
+                db=self.db,
+                field_value=user_id,
+                field_name=User.id,
+                _select=User,
+                selection_load_options=[(User.roles,)],
+            )
+            if not user:
+                raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail="Ошибка авторизации")
+            status, token_version, roles = await self.rotate_refresh_token(
+                payload_token=payload_token,
+                old_token=payload.refresh_token,
+                new_token=refresh_token,
+                roles=dump_roles(user.roles),
+            )
+        if status != ROTATION_OK:
+            raise HTTPException(status_code=HTTPStatus.FORBIDDEN, detail="Ошибка вайтлиста токенов")
 
-    async def logout(self, request: Request, current_user: User):
-        """Логаут."""
-        _id = await self.get_id_from_token(request=request)
-        user = await DBUser.get_by_field_name(db=self.db, field_name=User.id, field_value=_id, _select=User)
-        login_history = await DBLoginHistory.get_by_field_name(
+        await login_history_writer.write(
             db=self.db,
-            _select=LoginHistory,
-            field_name=LoginHistory.user_agent,
-            field_value=request.headers.get("user-agent"),
-            conditions=[(LoginHistory.host, request.headers.get("host"), operator.eq)],
+            user_id=uuid.UUID(user_id),
+            user_agent=request.headers.get("user-agent"),
+            host=request.headers.get("host"),
+        )
+        access_token = create_access_token(
+            subject=user_id,
+            roles=[RoleSimpleSchema(id=role_id, name=name) for role_id, name in roles],
+            token_version=token_version,
+            session_id=payload_token["sid"],
         )
-        if login_history:
-            nested_key = await self.get_nested_key(login_history)
+        return TokenSchema(access_token=access_token, refresh_token=refresh_token)
 
-            refresh_token = await self.hget_from_cache(user_id=str(current_user.id), nested_key=nested_key)
+    async def logout(self, request: Request, current_user: UserPrincipalSchema):
+        """Логаут: удаление рефреш токена сессии из токена."""
+        if current_user.sid:
+            await self.cache.hdel(str(current_user.id), current_user.sid)
 
-            if refresh_token:
-                await self.hdel(str(user.id), [nested_key])
+    async def logout_all(self, request: Request, current_user: UserPrincipalSchema):
+        """
+        Выйти из всех устройств.
 
-    async def logout_all(self, request: Request, current_user: User):
-        """Выйти из всех устройств."""
-        _id = await self.get_id_from_token(request=request)
-        user = await DBUser.get_by_field_name(db=self.db, field_name=User.id, field_value=_id, _select=User)
-        login_history = await DBLoginHistory.get_by_field_name(
-            db=self.db,
-            _select=LoginHistory,
-            field_name=LoginHistory.user_agent,
-            field_value=request.headers.get("user-agent"),
-            conditions=[(LoginHistory.host, request.headers.get("host"), operator.eq)],
-        )
-        if login_history:
-            keys = await self.cache.hgetall(str(user.id))
-            if keys:
-                await self.hdel(str(user.id), list(keys.keys()))
+        Поколение сессий растёт, и рефреш токены прежних поколений не принимаются,
+        даже если успели записаться после удаления хеша.
+        """
+        pipe = self.cache.pipeline(transaction=True)
+        pipe.incr(SESSION_GENERATION_KEY.format(user_id=current_user.id))
+        pipe.unlink(str(current_user.id))
+        await pipe.execute()
 
 
 @lru_cache()
@@ -245,50 +306,37 @@ class SocialService(SocialAbstractService):
             if user:
                 logger.info("User logged in from yandex")
                 logger.info(user)
-                role_ids = [str(el.id) for el in user.roles]
+                roles = user.roles
             else:
-                await DBUser.create(
-                    db=self.db, obj_in={"login": login, "first_name": first_name, "last_name": last_name}
-                )
-                user = await DBUser.get_by_field_name(
-                    db=self.db,
-                    _select=User,
-                    field_name=User.login,
-                    field_value=login,
-                    selection_load_options=[(User.roles,), (User.social,)],
-                )
-                role = await DBRole.get_by_field_name(
-                    db=self.db, _select=Role, field_name=Role.name, field_value="user"
-                )
-                await DBUser.add_role(db=self.db, role=role, user=user)
-                social = await DBSocial.get_by_field_name(
-                    db=self.db, _select=SocialNetwork, field_name=SocialNetwork.name, field_value=SocialEnum.yandex.name
-                )
-                await DBUser.add_social(social=social, db=self.db, user=user)
+                # Пользователь, роль и соцсеть - одной транзакцией
+                async with unit_of_work(self.db):
+                    await DBUser.create(
+                        db=self.db, obj_in={"login": login, "first_name": first_name, "last_name": last_name}
+                    )
+                    user = await DBUser.get_by_field_name(
+                        db=self.db,
+                        _select=User,
+                        field_name=User.login,
+                        field_value=login,
+                        selection_load_options=[(User.roles,), (User.social,)],
+                    )
+                    role = await DBRole.get_by_field_name(
+                        db=self.db, _select=Role, field_name=Role.name, field_value="user"
+                    )
+                    await DBUser.add_role(db=self.db, role=role, user=user)
+                    social = await DBSocial.get_by_field_name(
+                        db=self.db,
+                        _select=SocialNetwork,
+                        field_name=SocialNetwork.name,
+                        field_value=SocialEnum.yandex.name,
+                    )
+                    await DBUser.add_social(social=social, db=self.db, user=user)
                 logger.info("User created from yandex")
                 logger.info(user)
-                role_ids = [role.id]
-            login_history = await DBLoginHistory.create(
-                db=self.db,
-                obj_in={
-                    "user_id": user.id,
-                    "user_agent": "yandex",
-                    "host": "https://ya.ru",
-                },
-            )
-            nested_key = await self.auth_service.get_nested_key(login_history)
-            access_token = create_access_token(subject=user.id, role_ids=role_ids)
-            refresh_token = create_refresh_token(subject=user.id)
-            await self.auth_service.hset_to_cache(
-                user_id=str(user.id),
-                nested_key=nested_key,
-                refresh_token=refresh_token,
-                nx=True,
-                xx=False,
-                gt=False,
-                lt=False,
-            )
-            return {"access_token": access_token, "refresh_token": refresh_token}
+                roles = [role]
+            await login_history_writer.write(db=self.db, user_id=user.id, user_agent="yandex", host="https://ya.ru")
+            tokens = await self.auth_service.create_session(user_id=user.id, roles=roles)
+            return tokens.model_dump()
         return None
 
 
@@ -9,14 +9,19 @@ from fastapi import Depends, HTTPException
 from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio.session import AsyncSession
 
+from crud.base_crud import unit_of_work
 from crud.permissions import DBPermission
 from crud.roles import DBRole
 from crud.sections import DBSection
+from crud.users import DBUser
 from db.postgres import get_db
 from db.redis import get_redis
-from models.entity import Permission, Role, Section, User
-from schemas.entity import RoleCreateSchema
+from models.entity import Permission, Role
+from schemas.entity import RoleCreateSchema, UserPrincipalSchema
 from services.base import AbstractService
+from utils.auth import bump_token_version
+from utils.permissions import permission_matrix
+from utils.user_cache import user_cache
 
 logger = logging.getLogger(__name__)
 
@@ -24,16 +29,32 @@ logger = logging.getLogger(__name__)
 class RoleService(AbstractService):
     """Пользовательский сервис."""
 
-    async def create_role(self, payload: RoleCreateSchema, user: User) -> Role:
-        """Создание роли."""
+    async def validate_sections(self, payload: RoleCreateSchema) -> None:
+        """Проверка разделов пермишенов одним запросом."""
+        missing = await DBSection.get_missing_ids(db=self.db, ids=[el.section_id for el in payload.permissions])
+        if missing:
+            raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Section not found")
+
+    def detach_permissions(self, role: Role) -> List[uuid.UUID]:
+        """Id пермишенов роли перед удалением пачкой; объекты уходят из сессии, коллекция сбрасывается."""
+        permissions = list(role.permissions)
+        for permission in permissions:
+            self.db.expunge(permission)
+        self.db.expire(role, ["permissions"])
+        return [el.id for el in permissions]
+
+    async def create_role(self, payload: RoleCreateSchema, user: UserPrincipalSchema) -> Role:
+        """Создание роли с пермишенами в одной транзакции."""
         role = await DBRole.get_by_field_name(field_name=Role.name, field_value=payload.name, db=self.db, _select=Role)
         if role:
             raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Role already exists")
-        role = await DBRole.create(db=self.db, obj_in={"name": payload.name})
-        for el in payload.permissions:
-            el = el.model_dump()
-            el["role_id"] = role.id
-            await DBPermission.create(db=self.db, obj_in=el)
+        await self.validate_sections(payload)
+        async with unit_of_work(self.db):
+            role = await DBRole.create(db=self.db, obj_in={"name": payload.name})
+            await DBPermission.bulk_create(
+                db=self.db, rows=[{**el.model_dump(), "role_id": role.id} for el in payload.permissions]
+            )
+        await permission_matrix.invalidate(self.cache)
         return await DBRole.get_by_field_name(
             field_name=Role.id,
             field_value=role.id,
@@ -42,7 +63,7 @@ class RoleService(AbstractService):
             db=self.db,
         )
 
-    async def get_roles(self, user: User) -> List[Role]:
+    async def get_roles(self, user: UserPrincipalSchema) -> List[Role]:
         """Список ролей."""
         return await DBRole.get_list(
             _select=Role,
@@ -50,7 +71,7 @@ class RoleService(AbstractService):
             db=self.db,
         )
 
-    async def get_role(self, user: User, role_id: uuid.UUID) -> Role:
+    async def get_role(self, user: UserPrincipalSchema, role_id: uuid.UUID) -> Role:
         """Получение роли."""
         role = await DBRole.get_by_field_name(
             field_name=Role.id,
@@ -63,45 +84,40 @@ class RoleService(AbstractService):
             raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Role not found")
         return role
 
-    async def patch_role(self, user: User, role_id: uuid.UUID, payload: RoleCreateSchema) -> Role:
-        """Обновление роли."""
+    async def patch_role(self, user: UserPrincipalSchema, role_id: uuid.UUID, payload: RoleCreateSchema) -> Role:
+        """Обновление роли с заменой пермишенов в одной транзакции."""
         role = await DBRole.get_by_field_name(
             field_name=Role.id,
             field_value=role_id,
             db=self.db,
             _select=Role,
+            selection_load_options=[(Role.permissions,)],
         )
         if not role:
             raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Role does not exist")
-        await DBRole.update(db=self.db, obj_in={"name": payload.name}, db_obj=role)
-        role = await DBRole.get_by_field_name(
-            field_name=Role.id,
-            field_value=role_id,
-            db=self.db,
-            _select=Role,
-            selection_load_options=[(Role.permissions, Permission.section)],
-        )
-        permission_ids = [el.id for el in list(role.permissions)]
-        await DBPermission.bulk_remove(db=self.db, ids=permission_ids)
-        for el in payload.permissions:
-            section = await DBSection.get_by_field_name(
-                db=self.db, _select=Section, field_name=Section.id, field_value=el.section_id
+        await self.validate_sections(payload)
+        user_ids = []
+        async with unit_of_work(self.db):
+            if role.name != payload.name:
+                user_ids = await DBUser.get_ids_by_role(db=self.db, role_id=role.id)
+                await DBRole.update(db=self.db, obj_in={"name": payload.name}, db_obj=role)
+            await DBPermission.bulk_delete(db=self.db, ids=self.detach_permissions(role))
+            await DBPermission.bulk_create(
+                db=self.db, rows=[{**el.model_dump(), "role_id": role.id} for el in payload.permissions]
             )
-            if not section:
-                raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Section not found")
-            el = el.model_dump()
-            el["role_id"] = role.id
-            await DBPermission.create(db=self.db, obj_in=el)
-        role = await DBRole.get_by_field_name(
+        if user_ids:
+            await bump_token_version(self.cache, user_ids)
+            await user_cache.invalidate(self.cache, user_ids)
+        await permission_matrix.invalidate(self.cache)
+        return await DBRole.get_by_field_name(
             field_name=Role.id,
             field_value=role.id,
             _select=Role,
             selection_load_options=[(Role.permissions, Permission.section)],
             db=self.db,
         )
-        return role
 
-    async def delete_role(self, user: User, role_id: uuid.UUID):
+    async def delete_role(self, user: UserPrincipalSchema, role_id: uuid.UUID):
         """Удаление роли."""
         role = await DBRole.get_by_field_name(
             field_name=Role.id,
@@ -112,10 +128,13 @@ class RoleService(AbstractService):
         )
         if not role:
             raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Role does not exist")
-        permission_ids = [el.id for el in list(role.permissions)]
-        if permission_ids:
-            await DBPermission.bulk_remove(db=self.db, ids=permission_ids)
-        await DBRole.remove(db=self.db, _id=role_id)
+        user_ids = await DBUser.get_ids_by_role(db=self.db, role_id=role_id)
+        async with unit_of_work(self.db):
+            await DBPermission.bulk_delete(db=self.db, ids=self.detach_permissions(role))
+            await DBRole.remove(db=self.db, _id=role_id)
+        await bump_token_version(self.cache, user_ids)
+        await user_cache.invalidate(self.cache, user_ids)
+        await permission_matrix.invalidate(self.cache)
 
 
 @lru_cache()
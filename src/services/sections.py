@@ -9,24 +9,27 @@ from sqlalchemy.ext.asyncio.session import AsyncSession
 from crud.sections import DBSection
 from db.postgres import get_db
 from db.redis import get_redis
-from models.entity import Section, User
-from schemas.entity import SectionCreateSchema
+from models.entity import Section
+from schemas.entity import SectionCreateSchema, UserPrincipalSchema
 from services.base import AbstractService
+from utils.permissions import permission_matrix
 
 
 class SectionService(AbstractService):
     """Сервис разделов портала."""
 
-    async def create_section(self, payload: SectionCreateSchema, user: User) -> Section:
+    async def create_section(self, payload: SectionCreateSchema, user: UserPrincipalSchema) -> Section:
         """Создание раздела."""
         section = await DBSection.get_by_field_name(
             field_name=Section.name, field_value=payload.name, db=self.db, _select=Section
         )
         if section:
             raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Section already exists")
-        return await DBSection.create(db=self.db, obj_in=payload)
+        section = await DBSection.create(db=self.db, obj_in=payload)
+        await permission_matrix.invalidate(self.cache)
+        return section
 
-    async def get_sections(self, user: User):
+    async def get_sections(self, user: UserPrincipalSchema):
         """Список разделов."""
         return await DBSection.get_list(db=self.db, _select=Section)
 
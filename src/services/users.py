@@ -1,30 +1,54 @@
 """Сервисы пользователей."""
-import operator
 import uuid
+from datetime import datetime
 from functools import lru_cache
 from http import HTTPStatus
+from typing import List, Optional
 
 from fastapi import Depends, HTTPException
 from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.ext.asyncio.session import AsyncSession
-from werkzeug.security import generate_password_hash
 
 from crud.login_history import DBLoginHistory
-from crud.permissions import DBPermission
 from crud.roles import DBRole
-from crud.sections import DBSection
 from crud.users import DBUser
-from db.postgres import get_db
+from db.postgres import get_db, get_primary_sessions, primary_session
 from db.redis import get_redis
 from exceptions.users import UserNotFound
-from models.entity import LoginHistory, Permission, Role, Section, User
-from schemas.entity import PermissionUserSchema, RoleUserPatchSchema, SectionViewSchema, UserCreate, UserPatchSchema
+from models.entity import Role, User
+from schemas.entity import (
+    LoginHistoryPageSchema,
+    LoginHistorySchema,
+    PermissionUserSchema,
+    RoleUserPatchSchema,
+    UserBatchSchema,
+    UserCreate,
+    UserPatchSchema,
+    UserPrincipalSchema,
+    UserRoleSchema,
+)
 from services.base import AbstractService
+from utils.auth import bump_token_version
+from utils.cursor import decode_cursor, encode_cursor, to_naive_utc
+from utils.hashing import password_hasher
+from utils.permissions import ALL_SECTIONS, permission_matrix
+from utils.singleflight import SingleFlight
+from utils.user_cache import user_cache
+
+# Конкурентные RPC по одним и тем же id делят один запрос к базе
+me_flight = SingleFlight("me")
+users_flight = SingleFlight("users")
 
 
 class UserService(AbstractService):
     """Пользовательский сервис."""
 
+    def __init__(self, db: AsyncSession, cache: Redis, sessions: async_sessionmaker = primary_session) -> None:
+        """Инициализация сервиса; sessions - фабрика сессий основной базы для чтений, которым нельзя отставать."""
+        super().__init__(db, cache)
+        self.sessions = sessions
+
     async def register_user(self, user: UserCreate):
         """Сервис регистрации пользователей."""
         user_instance = await DBUser.get_by_field_name(
@@ -32,7 +56,10 @@ class UserService(AbstractService):
         )
         if user_instance:
             raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Login already exists")
-        return await DBUser.create(db=self.db, obj_in=user)
+        password_hash = await password_hasher.hash(user.password)
+        return await DBUser.create(
+            db=self.db, obj_in={**user.model_dump(exclude={"password"}), "password_hash": password_hash}
+        )
 
     async def patch_user(self, user: UserPatchSchema, current_user: User):
         """Патч логина и пароля."""
@@ -41,10 +68,12 @@ class UserService(AbstractService):
         )
         if user_instance and current_user != user_instance:
             raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Логин уже существует")
-        user.password = generate_password_hash(user.password)
-        return await DBUser.update(db_obj=current_user, db=self.db, obj_in=user)
+        user.password = await password_hasher.hash(user.password)
+        current_user = await DBUser.update(db_obj=current_user, db=self.db, obj_in=user)
+        await user_cache.invalidate(self.cache, [current_user.id])
+        return current_user
 
-    async def check_role(self, role_name: str, user: User):
+    async def check_role(self, role_name: str, user: UserPrincipalSchema):
         """Проверка роли."""
         return {"name": role_name, "has": await DBUser.is_role(role_name=role_name, _uuid=user.id, db=self.db)}
 
@@ -62,49 +91,103 @@ class UserService(AbstractService):
             if await DBUser.is_role(db=self.db, role_name=payload.name, _uuid=user.id):
                 raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="User already has such role")
             await DBUser.add_role(db=self.db, role=role, user=user)
+        await bump_token_version(self.cache, [user.id])
+        await user_cache.invalidate(self.cache, [user.id])
 
-    async def check_permission(self, section_name: str, user: User) -> PermissionUserSchema:
-        """Проверка пермишена."""
-        section = await DBSection.get_by_field_name(
-            db=self.db, field_name=Section.name, field_value=section_name, _select=Section
+    async def check_permission(self, section_name: str, user: UserPrincipalSchema) -> PermissionUserSchema:
+        """Проверка пермишена по матрице в памяти."""
+        role_ids = [el.id for el in list(user.roles)]
+        section, permission = await permission_matrix.check(
+            sessions=self.sessions, section_name=section_name, role_ids=role_ids
         )
         if not section:
             raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Section not found")
-        role_ids = [el.id for el in list(user.roles)]
         if not role_ids:
             raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Roles not found")
-        permissions = await DBPermission.get_list(
-            db=self.db,
-            _select=Permission,
-            conditions=[(Permission.section_id, section.id, operator.eq)],
-            condition_any=[{Permission.role_id: role_ids}],
-        )
-        if not permissions:
+        if not permission:
             raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Permissions not found")
-        section_schema = SectionViewSchema(**section.__dict__)
-        permission_schema = PermissionUserSchema(section=section_schema)
-        for el in permissions:
-            if el.can_view:
-                permission_schema.can_view = True
-            if el.can_edit:
-                permission_schema.can_edit = True
-            if el.can_delete:
-                permission_schema.can_delete = True
-        return permission_schema
-
-    async def login_history(self, user: User):
+        return permission
+
+    async def check_permissions(
+        self, section_names: List[str], user: UserPrincipalSchema
+    ) -> List[PermissionUserSchema]:
+        """Проверка пермишенов по нескольким разделам; ALL_SECTIONS - по всем."""
+        role_ids = [el.id for el in list(user.roles)]
+        names = None if ALL_SECTIONS in section_names else section_names
+        permissions, missing = await permission_matrix.check_many(
+            sessions=self.sessions, section_names=names, role_ids=role_ids
+        )
+        if missing:
+            raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=f"Sections not found: {', '.join(missing)}")
+        return permissions
+
+    async def login_history(
+        self,
+        user: UserPrincipalSchema,
+        size: int,
+        cursor: Optional[str] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+    ) -> LoginHistoryPageSchema:
         """Получение истории логинов."""
-        return await DBLoginHistory.get_list(
-            _select=LoginHistory,
+        rows = await DBLoginHistory.get_page(
             db=self.db,
-            conditions=[(LoginHistory.user_id, user.id, operator.eq)],
-            order=LoginHistory.created_at,
+            user_id=user.id,
+            size=size,
+            after=decode_cursor(cursor) if cursor else None,
+            date_from=to_naive_utc(date_from),
+            date_to=to_naive_utc(date_to),
+        )
+        items = [LoginHistorySchema.model_validate(row._mapping) for row in rows[:size]]
+        next_cursor = encode_cursor(items[-1].created_at, items[-1].id) if len(rows) > size else None
+        return LoginHistoryPageSchema(items=items, size=size, next_cursor=next_cursor)
+
+    async def load_me(self, user_id: uuid.UUID) -> UserRoleSchema:
+        """Пользователь с ролями из основной базы с записью в кеш, если его не инвалидировали во время чтения."""
+        generations = await user_cache.generations(self.cache, [user_id])
+        async with self.sessions() as db:
+            user = UserRoleSchema.model_validate(await self.get_user_by_id(user_id=user_id, db=db))
+        await user_cache.set(self.cache, user, generations)
+        return user
+
+    async def get_me(self, user_id: uuid.UUID) -> UserRoleSchema:
+        """Пользователь с ролями для RPC me: сначала кеш, при промахе один поход в базу на все конкурентные вызовы."""
+        user = await user_cache.get(self.cache, user_id)
+        if user is None:
+            user = await me_flight.do(user_id, lambda: self.load_me(user_id))
+        return user
+
+    async def load_users(self, user_ids: List[uuid.UUID]) -> List[UserRoleSchema]:
+        """Пользователи с ролями из основной базы одним запросом с записью в кеш не инвалидированных за чтение."""
+        generations = await user_cache.generations(self.cache, user_ids)
+        async with self.sessions() as db:
+            loaded = [
+                UserRoleSchema.model_validate(user) for user in await DBUser.get_with_roles_by_ids(db=db, ids=user_ids)
+            ]
+        await user_cache.set_many(self.cache, loaded, generations)
+        return loaded
+
+    async def get_users(self, user_ids: List[uuid.UUID]) -> UserBatchSchema:
+        """Пользователи с ролями по списку id: попадания из кеша, промахи одним запросом к базе."""
+        user_ids = list(dict.fromkeys(user_ids))
+        found = await user_cache.get_many(self.cache, user_ids)
+        misses = [user_id for user_id in user_ids if user_id not in found]
+        if misses:
+            loaded = await users_flight.do(frozenset(misses), lambda: self.load_users(misses))
+            found.update((user.id, user) for user in loaded)
+        return UserBatchSchema(
+            items=[found[user_id] for user_id in user_ids if user_id in found],
+            missing=[user_id for user_id in user_ids if user_id not in found],
         )
 
-    async def get_user_by_id(self, user_id: uuid) -> User:
+    async def get_user_by_id(self, user_id: uuid, db: Optional[AsyncSession] = None) -> User:
         """Получение пользователя по id прежде всего через кролика."""
         user = await DBUser.get_by_field_name(
-            field_name=User.id, field_value=user_id, db=self.db, _select=User, selection_load_options=[(User.roles,)]
+            field_name=User.id,
+            field_value=user_id,
+            db=db or self.db,
+            _select=User,
+            selection_load_options=[(User.roles,)],
         )
         if not user:
             raise UserNotFound(user_id=user_id)
@@ -112,6 +195,10 @@ class UserService(AbstractService):
 
 
 @lru_cache()
-def get_user_service(db: AsyncSession = Depends(get_db), cache: Redis = Depends(get_redis)) -> UserService:
+def get_user_service(
+    db: AsyncSession = Depends(get_db),
+    cache: Redis = Depends(get_redis),
+    sessions: async_sessionmaker = Depends(get_primary_sessions),
+) -> UserService:
     """Получить сервис жанров."""
-    return UserService(db, cache)
+    return UserService(db, cache, sessions)
@@ -130,6 +130,13 @@ async def test_logout():
 
     refresh = data.get("refresh_token")
 
+    response = client.post(
+        "/api/auth/v1/auth/login",
+        json={"login": "login1", "password": "password"},
+        headers={"X-Request-Id": "0x62ba858d7719d51d6a3255394cdd8b9a"},
+    )
+    other_refresh = response.json().get("refresh_token")
+
     response = client.delete(
         "/api/auth/v1/auth/logout",
         headers={
@@ -159,6 +166,14 @@ async def test_logout():
 
     assert response.status_code == HTTPStatus.FORBIDDEN
 
+    response = client.post(
+        "/api/auth/v1/auth/refresh",
+        json={"refresh_token": other_refresh},
+        headers={"X-Request-Id": "0x62ba858d7719d51d6a3255394cdd8b9a"},
+    )
+
+    assert response.status_code == HTTPStatus.OK
+
 
 async def test_logout_all():
     """Выйти на всех устройствах."""
@@ -1,11 +1,15 @@
 """Тест ролей."""
 
 import logging
+import re
 from http import HTTPStatus
 
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
+from core.config import settings
 from main import app
 
 logger = logging.getLogger(__name__)
@@ -47,6 +51,20 @@ logger = logging.getLogger(__name__)
             {"name": "Role2", "permissions": [{"can_view": True, "can_edit": True, "can_delete": True}]},
             {"status": HTTPStatus.UNPROCESSABLE_CONTENT},
         ),
+        (
+            {
+                "name": "Role4",
+                "permissions": [
+                    {
+                        "can_view": True,
+                        "can_edit": True,
+                        "can_delete": True,
+                        "section_id": "80416a87-d64b-4cba-ae33-6db1f0366ce7",
+                    }
+                ],
+            },
+            {"status": HTTPStatus.BAD_REQUEST},
+        ),
         (
             {
                 "name": "Role2",
@@ -138,6 +156,38 @@ async def test_get_roles():
     assert len(data) == 5
 
 
+@pytest.mark.parametrize("stateless_auth, expected_lookups", [(True, 0), (False, 1)])
+async def test_user_resolved_once_per_request(mocker, stateless_auth, expected_lookups):
+    """Пользователь запроса загружается из базы не больше одного раза."""
+    mocker.patch.object(settings, "stateless_auth", stateless_auth)
+    client = TestClient(app)
+
+    response = client.post(
+        "/api/auth/v1/auth/login",
+        json={"login": "login1", "password": "password"},
+        headers={"X-Request-Id": "0x62ba858d7719d51d6a3255394cdd8b9a"},
+    )
+    access = response.json().get("access_token")
+
+    statements = []
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", collect)
+    try:
+        response = client.get(
+            "/api/auth/v1/roles",
+            headers={"Authorization": f"Bearer {access}", "X-Request-Id": "0x62ba858d7719d51d6a3255394cdd8b9a"},
+        )
+    finally:
+        event.remove(Engine, "before_cursor_execute", collect)
+
+    assert response.status_code == HTTPStatus.OK
+    user_lookups = [el for el in statements if re.search(r"FROM users\s+WHERE users\.id", el)]
+    assert len(user_lookups) == expected_lookups
+
+
 @pytest.mark.parametrize(
     "query_data, expected_answer",
     [
@@ -275,6 +325,73 @@ async def test_check_permission(query_data, expected_answer):
         assert expected_answer == data
 
 
+async def test_check_permission_without_sql():
+    """Проверка пермишена отвечает из матрицы в памяти без запросов к базе."""
+    client = TestClient(app)
+
+    response = client.post(
+        "/api/auth/v1/auth/login",
+        json={"login": "login1", "password": "password"},
+        headers={"X-Request-Id": "0x62ba858d7719d51d6a3255394cdd8b9a"},
+    )
+    headers = {
+        "Authorization": f"Bearer {response.json().get('access_token')}",
+        "X-Request-Id": "0x62ba858d7719d51d6a3255394cdd8b9a",
+    }
+    response = client.get("/api/auth/v1/roles/permissions", headers=headers, params={"section_name": "Section1"})
+
+    assert response.status_code == HTTPStatus.OK
+
+    statements = []
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", collect)
+    try:
+        response = client.get("/api/auth/v1/roles/permissions", headers=headers, params={"section_name": "Section1"})
+    finally:
+        event.remove(Engine, "before_cursor_execute", collect)
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json().get("can_view") is True
+    assert statements == []
+
+
+@pytest.mark.parametrize(
+    "query_data, expected_answer",
+    [
+        ({"section_names": ["Section1"]}, {"status": HTTPStatus.OK}),
+        ({"section_names": ["all"]}, {"status": HTTPStatus.OK}),
+        ({"section_names": ["Section1", "Section2"]}, {"status": HTTPStatus.BAD_REQUEST}),
+        ({}, {"status": HTTPStatus.UNPROCESSABLE_ENTITY}),
+    ],
+)
+async def test_check_permissions(query_data, expected_answer):
+    """Тест проверки пермишенов по нескольким разделам."""
+    client = TestClient(app)
+
+    response = client.post(
+        "/api/auth/v1/auth/login",
+        json={"login": "login1", "password": "password"},
+        headers={"X-Request-Id": "0x62ba858d7719d51d6a3255394cdd8b9a"},
+    )
+    access = response.json().get("access_token")
+
+    response = client.get(
+        "/api/auth/v1/roles/permissions/batch",
+        headers={"Authorization": f"Bearer {access}", "X-Request-Id": "0x62ba858d7719d51d6a3255394cdd8b9a"},
+        params=query_data,
+    )
+
+    assert response.status_code == expected_answer.get("status")
+    if response.status_code == HTTPStatus.OK:
+        permissions = {el["section"]["name"]: el for el in response.json()}
+        assert permissions["Section1"]["can_view"] is True
+        assert permissions["Section1"]["can_edit"] is True
+        assert permissions["Section1"]["can_delete"] is True
+
+
 @pytest.mark.parametrize(
     "role_id, expected_answer",
     [
@@ -1,11 +1,34 @@
 """Тесты пользователей."""
 
+import asyncio
+import csv
+import io
+import json
+import logging
+import operator
+import re
+import uuid
 from http import HTTPStatus
 
 import pytest
 from fastapi.testclient import TestClient
+from jose import jwt
+from redis.asyncio import Redis
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
+from core.config import settings
+from crud.users import DBUser
+from db.postgres import make_engine
+from import_users import read_batches
 from main import app
+from models.entity import User
+from services.users import UserService
+from utils.singleflight import SingleFlight
+from utils.user_cache import user_cache
+
+logger = logging.getLogger(__name__)
 
 
 @pytest.mark.parametrize(
@@ -82,17 +105,214 @@ async def test_login_history():
 
     access = data.get("access_token")
 
-    response = client.get(
-        "/api/auth/v1/users/login_history",
-        headers={"Authorization": f"Bearer {access}", "X-Request-Id": "0x62ba858d7719d51d6a3255394cdd8b9b"},
-        params={"page": 1, "size": 10},
+    response = client.post(
+        "/api/auth/v1/auth/login",
+        json={"login": "login20", "password": "password20"},
+        headers={"X-Request-Id": "0x62ba858d7719d51d6a3255394cdd8b9b"},
     )
+    assert response.status_code == HTTPStatus.OK
+
+    headers = {"Authorization": f"Bearer {access}", "X-Request-Id": "0x62ba858d7719d51d6a3255394cdd8b9b"}
+    response = client.get("/api/auth/v1/users/login_history", headers=headers, params={"size": 1})
 
     data = response.json()
 
     assert response.status_code == HTTPStatus.OK
-    assert data.get("total") is not None
-    assert data.get("page") is not None
-    assert data.get("size") is not None
-    assert data.get("pages") is not None
-    assert data.get("items") is not None
+    assert data.get("size") == 1
+    assert len(data.get("items")) == 1
+    assert data.get("next_cursor") is not None
+
+    response = client.get(
+        "/api/auth/v1/users/login_history", headers=headers, params={"size": 1, "cursor": data["next_cursor"]}
+    )
+    next_data = response.json()
+
+    assert response.status_code == HTTPStatus.OK
+    assert len(next_data.get("items")) == 1
+    assert next_data["items"][0]["created_at"] <= data["items"][0]["created_at"]
+    assert next_data["items"][0]["id"] != data["items"][0]["id"]
+
+    response = client.get(
+        "/api/auth/v1/users/login_history", headers=headers, params={"date_from": "2000-01-01", "date_to": "2000-02-01"}
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json().get("items") == []
+
+    response = client.get("/api/auth/v1/users/login_history", headers=headers, params={"cursor": "broken"})
+
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+async def test_get_users_batch():
+    """Тестирование пакетного получения пользователей."""
+    client = TestClient(app)
+
+    response = client.post(
+        "/api/auth/v1/auth/login",
+        json={"login": "login1", "password": "password"},
+        headers={"X-Request-Id": "0x62ba858d7719d51d6a3255394cdd8b9b"},
+    )
+    access = response.json().get("access_token")
+    user_id = jwt.get_unverified_claims(access)["sub"]
+    unknown_id = str(uuid.uuid4())
+    headers = {"Authorization": f"Bearer {access}", "X-Request-Id": "0x62ba858d7719d51d6a3255394cdd8b9b"}
+
+    response = client.post("/api/auth/v1/users/batch", headers=headers, json={"ids": []})
+
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    for _ in range(2):
+        response = client.post("/api/auth/v1/users/batch", headers=headers, json={"ids": [user_id, unknown_id]})
+        data = response.json()
+
+        assert response.status_code == HTTPStatus.OK
+        assert [el["id"] for el in data["items"]] == [user_id]
+        assert data["items"][0]["first_name"] == "User1"
+        assert "admin" in [role["name"] for role in data["items"][0]["roles"]]
+        assert data["missing"] == [unknown_id]
+
+
+async def test_export_users():
+    """Тестирование потоковой выгрузки пользователей."""
+    client = TestClient(app)
+
+    response = client.post(
+        "/api/auth/v1/auth/login",
+        json={"login": "login1", "password": "password"},
+        headers={"X-Request-Id": "0x62ba858d7719d51d6a3255394cdd8b9b"},
+    )
+    access = response.json().get("access_token")
+    headers = {"Authorization": f"Bearer {access}", "X-Request-Id": "0x62ba858d7719d51d6a3255394cdd8b9b"}
+
+    response = client.get("/api/auth/v1/users/export", headers=headers, params={"format": "xml"})
+
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    response = client.get("/api/auth/v1/users/export", headers=headers)
+    users = {el["login"]: el for el in map(json.loads, response.text.splitlines())}
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert users["login1"]["first_name"] == "User1"
+    assert "admin" in users["login1"]["roles"]
+
+    response = client.get("/api/auth/v1/users/export", headers=headers, params={"format": "csv"})
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+
+    assert response.status_code == HTTPStatus.OK
+    assert "admin" in {el["login"]: el for el in rows}["login1"]["roles"].split(",")
+
+
+async def test_get_by_field_name_none_condition():
+    """Условие с None сравнивается через IS NULL и IS NOT NULL, а не через = NULL."""
+    engine = make_engine(settings.postgres_host)
+    try:
+        async with AsyncSession(engine, expire_on_commit=False) as db:
+            found = {}
+            for comparison in (operator.eq, operator.ne):
+                found[comparison] = await DBUser.get_by_field_name(
+                    db=db,
+                    _select=User,
+                    field_name=User.login,
+                    field_value="login1",
+                    conditions=[(User.last_name, None, comparison)],
+                )
+            users = await DBUser.get_list(
+                db=db,
+                _select=User,
+                conditions=[(User.last_name, None, operator.ne), (User.login, "login1", operator.eq)],
+            )
+    finally:
+        await engine.dispose()
+
+    assert found[operator.eq] is None
+    assert found[operator.ne].login == "login1"
+    assert [el.login for el in users] == ["login1"]
+
+
+async def test_me_singleflight():
+    """Конкурентные me по одному пользователю делают один запрос к базе вместо запроса на каждый вызов."""
+    engine = make_engine(settings.postgres_host)
+    cache = Redis(host=settings.redis_host, port=settings.redis_port, db=1)
+    statements = []
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    try:
+        async with AsyncSession(engine, expire_on_commit=False) as db:
+            user = await DBUser.get_by_field_name(db=db, _select=User, field_name=User.login, field_value="login1")
+            await user_cache.invalidate(cache, [user.id])
+            user_service = UserService(db, cache, async_sessionmaker(engine, expire_on_commit=False))
+
+            event.listen(Engine, "before_cursor_execute", collect)
+            try:
+                results = await asyncio.gather(*(user_service.get_me(user_id=user.id) for _ in range(50)))
+            finally:
+                event.remove(Engine, "before_cursor_execute", collect)
+    finally:
+        await cache.aclose()
+        await engine.dispose()
+
+    user_selects = [statement for statement in statements if re.search(r"FROM users\s+WHERE users\.id", statement)]
+    logger.info("50 concurrent me calls, SELECT FROM users: %s", len(user_selects))
+
+    assert {el.id for el in results} == {user.id}
+    assert len(user_selects) == 1
+
+
+async def test_singleflight_leader_cancelled():
+    """Отмена первого вызывающего не отменяет общий вызов для остальных."""
+    flight = SingleFlight("test")
+    started = asyncio.Event()
+    release = asyncio.Event()
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        started.set()
+        await release.wait()
+        return "result"
+
+    leader = asyncio.create_task(flight.do("key", call))
+    await started.wait()
+    followers = [asyncio.create_task(flight.do("key", call)) for _ in range(3)]
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+
+    release.set()
+
+    assert await asyncio.gather(*followers) == ["result"] * 3
+    assert calls == 1
+    assert "key" not in flight.calls
+
+
+def test_import_rejects_broken_records(tmp_path):
+    """Битые строки импорта отклоняются по одной, записи после них импортируются."""
+    source = tmp_path / "users.ndjson"
+    source.write_text(
+        '{"login": "import1", "password": "password"}\n'
+        '{"login": "import2", \n'
+        '["not", "an", "object"]\n'
+        "\n"
+        '{"login": 42}\n'
+        f'{{"login": "import3", "password_hash": "{"x" * 256}"}}\n'
+        '{"login": "import4", "first_name": "Import4"}\n'
+    )
+
+    batches = list(read_batches(source, "ndjson", 0, 10, ["user"], {"user"}))
+
+    assert [(consumed, [el.login for el in records], rejected) for consumed, records, rejected in batches] == [
+        (6, ["import1", "import4"], 4)
+    ]
+
+    batches = list(read_batches(source, "ndjson", 2, 10, ["user"], {"user"}))
+
+    assert [(consumed, [el.login for el in records], rejected) for consumed, records, rejected in batches] == [
+        (4, ["import4"], 3)
+    ]
@@ -1,27 +1,66 @@
 """Утилиты модуля auth."""
 import logging
+import secrets
 from datetime import UTC, datetime, timedelta
 from functools import wraps
-from typing import Annotated, Any, List, Union
+from typing import Annotated, Any, Dict, Iterable, List, Optional, Union
 
-from async_fastapi_jwt_auth import AuthJWT
 from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, OAuth2PasswordBearer
-from jose import jwt
+from fastapi.security.utils import get_authorization_scheme_param
+from jose import JWTError
+from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio.session import AsyncSession
 
 from core.config import settings
 from crud.users import DBUser
-from db.postgres import get_db
-from models.entity import User
-from schemas.entity import UserRoleEnum, UserRoleSchema
+from db.postgres import bind_principal, get_db
+from db.redis import get_redis
+from models.entity import Role, User
+from schemas.entity import RoleSimpleSchema, UserPrincipalSchema, UserRoleEnum
+from utils.keys import decode_jwt, encode_jwt
 
 logger = logging.getLogger(__name__)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=settings.login_url)
 
+TOKEN_VERSION_KEY = "token_version:{user_id}"
+SESSION_GENERATION_KEY = "session_generation:{user_id}"
 
-def create_access_token(subject: Union[str, Any], role_ids: List, expires_delta: int = None) -> str:
+
+async def get_token_version(cache: Redis, user_id: Union[str, Any]) -> int:
+    """Текущая версия токенов пользователя."""
+    version = await cache.get(TOKEN_VERSION_KEY.format(user_id=user_id))
+    return int(version) if version else 0
+
+
+async def bump_token_version(cache: Redis, user_ids: Iterable[Union[str, Any]]) -> None:
+    """Инвалидация клеймов выданных токенов: следующий запрос пойдёт в базу."""
+    pipe = cache.pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.incr(TOKEN_VERSION_KEY.format(user_id=user_id))
+    if pipe.command_stack:
+        await pipe.execute()
+
+
+def new_session_id() -> str:
+    """Короткий идентификатор сессии для клейма sid."""
+    return secrets.token_urlsafe(12)
+
+
+async def get_session_generation(cache: Redis, user_id: Union[str, Any]) -> int:
+    """Поколение сессий пользователя; растёт при выходе со всех устройств."""
+    generation = await cache.get(SESSION_GENERATION_KEY.format(user_id=user_id))
+    return int(generation) if generation else 0
+
+
+def create_access_token(
+    subject: Union[str, Any],
+    roles: List[Union[Role, RoleSimpleSchema]],
+    token_version: int = 0,
+    session_id: Optional[str] = None,
+    expires_delta=None,
+) -> str:
     """Аксесс токен."""
     if expires_delta is not None:
         expires_delta = datetime.now(UTC) + expires_delta
@@ -32,50 +71,145 @@ def create_access_token(subject: Union[str, Any], role_ids: List, expires_delta:
         "exp": expires_delta,
         "sub": str(subject),
         "type": "access",
-        "roles": role_ids,
+        "roles": [str(role.id) for role in roles],
+        "role_names": [role.name for role in roles],
+        "ver": token_version,
     }
-    encoded_jwt = jwt.encode(to_encode, settings.secret_key, settings.algorithm)
+    if session_id:
+        to_encode["sid"] = session_id
+    encoded_jwt = encode_jwt(to_encode)
     return encoded_jwt
 
 
-def create_refresh_token(subject: Union[str, Any], expires_delta: int = None) -> str:
+def create_refresh_token(
+    subject: Union[str, Any], session_id: Optional[str] = None, generation: int = 0, expires_delta: int = None
+) -> str:
     """Рефреш токен."""
     if expires_delta is not None:
         expires_delta = datetime.now(UTC) + expires_delta
     else:
         expires_delta = datetime.now(UTC) + timedelta(minutes=settings.refresh_token_expire_minutes)
 
-    to_encode = {"exp": expires_delta, "sub": str(subject), "type": "refresh"}
-    encoded_jwt = jwt.encode(to_encode, settings.secret_key, settings.algorithm)
+    to_encode = {"exp": expires_delta, "sub": str(subject), "type": "refresh", "gen": generation}
+    if session_id:
+        to_encode["sid"] = session_id
+    encoded_jwt = encode_jwt(to_encode)
     return encoded_jwt
 
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSession = Depends(get_db)):
-    """Получение пользователя из токена."""
-    credentials_exception = HTTPException(
+def decode_access_token(token: str) -> Dict:
+    """Проверка подписи и типа аксесс токена."""
+    payload = decode_jwt(token)
+    if payload.get("type") != "access" or payload.get("sub") is None:
+        raise JWTError("Invalid access token")
+    return payload
+
+
+def principal_from_claims(payload: Dict) -> UserPrincipalSchema:
+    """Пользователь из клеймов токена без обращения к базе."""
+    roles = [
+        RoleSimpleSchema(id=role_id, name=role_name)
+        for role_id, role_name in zip(payload.get("roles", []), payload.get("role_names", []))
+    ]
+    return UserPrincipalSchema(id=payload["sub"], roles=roles, sid=payload.get("sid"))
+
+
+async def get_user_entity(request: Request, payload: Dict, db: AsyncSession) -> Optional[User]:
+    """Модель пользователя из базы, не чаще одного раза за запрос."""
+    if not hasattr(request.state, "user_entity"):
+        request.state.user_entity = await DBUser.get_by_field_name(
+            db=db, field_value=payload["sub"], field_name=User.id, _select=User, selection_load_options=[(User.roles,)]
+        )
+    return request.state.user_entity
+
+
+async def get_principal(
+    request: Request, payload: Dict, db: AsyncSession, cache: Redis
+) -> Optional[UserPrincipalSchema]:
+    """
+    Пользователь из токена.
+
+    Если версия в токене совпадает с текущей, пользователь собирается из клеймов.
+    В базу идём только при расхождении версии (смена ролей, удаление роли) или в stateful режиме.
+    """
+    if settings.stateless_auth and "ver" in payload:
+        if payload["ver"] == await get_token_version(cache, payload["sub"]):
+            return principal_from_claims(payload)
+    user = await get_user_entity(request=request, payload=payload, db=db)
+    if user is None:
+        return None
+    principal = UserPrincipalSchema.model_validate(user)
+    principal.sid = payload.get("sid")
+    return principal
+
+
+def get_credentials_exception() -> HTTPException:
+    """Ошибка авторизации."""
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Ошибка валидации токена",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except Exception:
-        raise credentials_exception
-    user = await DBUser.get_by_field_name(
-        db=db, field_value=username, field_name=User.id, _select=User, selection_load_options=[(User.roles,)]
-    )
+
+
+def get_token_payload(request: Request, token: str) -> Dict:
+    """Декодирование токена, не чаще одного раза за запрос."""
+    if not hasattr(request.state, "token_payload"):
+        try:
+            request.state.token_payload = decode_access_token(token)
+        except JWTError:
+            raise get_credentials_exception()
+    return request.state.token_payload
+
+
+async def resolve_principal(
+    request: Request, token: Optional[str], db: AsyncSession, cache: Redis
+) -> Optional[UserPrincipalSchema]:
+    """
+    Пользователь запроса.
+
+    Результат кешируется в request.state, поэтому JWTBearer, get_current_user и roles_required
+    разделяют одну проверку токена и один поход за пользователем.
+    """
+    if not hasattr(request.state, "principal"):
+        principal = None
+        if token:
+            payload = get_token_payload(request=request, token=token)
+            bind_principal(db, payload["sub"])
+            principal = await get_principal(request=request, payload=payload, db=db, cache=cache)
+        request.state.principal = principal
+    return request.state.principal
+
+
+async def get_current_user(
+    request: Request,
+    token: Annotated[str, Depends(oauth2_scheme)],
+    db: AsyncSession = Depends(get_db),
+    cache: Redis = Depends(get_redis),
+) -> UserPrincipalSchema:
+    """Получение пользователя из токена."""
+    user = await resolve_principal(request=request, token=token, db=db, cache=cache)
+    if user is None:
+        raise get_credentials_exception()
+    return user
+
+
+async def get_current_user_entity(
+    request: Request, token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSession = Depends(get_db)
+) -> User:
+    """Получение модели пользователя из токена для ручек, изменяющих пользователя."""
+    payload = get_token_payload(request=request, token=token)
+    bind_principal(db, payload["sub"])
+    user = await get_user_entity(request=request, payload=payload, db=db)
     if user is None:
-        raise credentials_exception
+        raise get_credentials_exception()
     return user
 
 
 class AuthRequest(Request):
     """Прокидывание модели пользователя в реквест."""
 
-    custom_user: UserRoleSchema
+    custom_user: UserPrincipalSchema
 
 
 class JWTBearer(HTTPBearer):
@@ -85,22 +219,17 @@ class JWTBearer(HTTPBearer):
         """Инит."""
         super().__init__(auto_error=auto_error)
 
-    async def __call__(self, request: Request, db: AsyncSession = Depends(get_db)) -> UserRoleSchema | None:
+    async def __call__(
+        self, request: Request, db: AsyncSession = Depends(get_db), cache: Redis = Depends(get_redis)
+    ) -> UserPrincipalSchema | None:
         """Возврат схемы пользователя."""
-        authorize = AuthJWT(req=request)
-        authorize._algorithm = settings.algorithm
-        authorize._secret_key = settings.secret_key
-        await authorize.jwt_optional()
-        user_id = await authorize.get_jwt_subject()
-        if not user_id:
-            return None
-        user = await DBUser.get_by_field_name(
-            db=db, field_name=User.id, field_value=user_id, _select=User, selection_load_options=[(User.roles,)]
-        )
-        return UserRoleSchema.model_validate(user)
+        scheme, token = get_authorization_scheme_param(request.headers.get("Authorization"))
+        if scheme.lower() != "bearer":
+            token = None
+        return await resolve_principal(request=request, token=token, db=db, cache=cache)
 
 
-async def get_current_user_global(request: AuthRequest, user: AsyncSession = Depends(JWTBearer())):
+async def get_current_user_global(request: AuthRequest, user: UserPrincipalSchema = Depends(JWTBearer())):
     """Прокидывание пользователя на корневом уровне."""
     request.custom_user = user  # noqa
 
@@ -111,7 +240,8 @@ def roles_required(roles_list: list[UserRoleEnum]):
     def decorator(function):
         @wraps(function)
         async def wrapper(*args, **kwargs):
-            user: UserRoleSchema = kwargs.get("request").custom_user
+            request: Request = kwargs.get("request")
+            user: Optional[UserPrincipalSchema] = getattr(request.state, "principal", None)
 
             if not user:
                 raise HTTPException(
@@ -0,0 +1,29 @@
+"""Курсоры keyset-пагинации."""
+import base64
+import uuid
+from datetime import UTC, datetime
+from http import HTTPStatus
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+
+
+def encode_cursor(created_at: datetime, _id: uuid.UUID) -> str:
+    """Курсор из ключа последней строки страницы."""
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    """Ключ строки из курсора."""
+    try:
+        created_at, _id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), uuid.UUID(_id)
+    except ValueError:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Некорректный курсор")
+
+
+def to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Приведение даты к UTC без зоны, как хранится created_at."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(UTC).replace(tzinfo=None)
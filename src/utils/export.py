@@ -0,0 +1,65 @@
+"""Потоковая выгрузка пользователей."""
+import csv
+import io
+from typing import AsyncIterator, Callable, Dict, Sequence
+
+import orjson
+from sqlalchemy import Row
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from core.config import settings
+from crud.users import DBUser
+
+EXPORT_FIELDS = ("id", "login", "first_name", "last_name", "created_at", "roles", "social")
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def to_ndjson(rows: Sequence[Row]) -> str:
+    """Пачка строк в NDJSON."""
+    return "".join(orjson.dumps(row._asdict()).decode() + "\n" for row in rows)
+
+
+def to_csv(rows: Sequence[Row]) -> str:
+    """Пачка строк в CSV; роли и соцсети через запятую."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(
+            (
+                row.id,
+                row.login,
+                row.first_name,
+                row.last_name,
+                row.created_at.isoformat() if row.created_at else "",
+                ",".join(row.roles),
+                ",".join(row.social),
+            )
+        )
+    return buffer.getvalue()
+
+
+def csv_header() -> str:
+    """Заголовок CSV."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(EXPORT_FIELDS)
+    return buffer.getvalue()
+
+
+SERIALIZERS: Dict[str, Callable[[Sequence[Row]], str]] = {"ndjson": to_ndjson, "csv": to_csv}
+
+
+async def export_users(
+    fmt: str, sessions: async_sessionmaker, yield_per: int = settings.export_yield_per
+) -> AsyncIterator[str]:
+    """
+    Выгрузка пользователей с ролями и соцсетями кусками по yield_per строк.
+
+    Сессия открывается из sessions внутри генератора и живёт, пока читается курсор, поэтому генератор
+    можно отдавать в StreamingResponse: в памяти одновременно только одна пачка.
+    """
+    serialize = SERIALIZERS[fmt]
+    if fmt == "csv":
+        yield csv_header()
+    async with sessions() as db:
+        async for rows in DBUser.stream_export(db=db, yield_per=yield_per):
+            yield serialize(rows)
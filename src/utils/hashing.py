@@ -0,0 +1,123 @@
+"""Хеширование паролей вне event loop."""
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from core.config import settings
+from core.metrics import meter
+
+logger = logging.getLogger(__name__)
+
+hash_duration = meter.create_histogram(
+    "auth.password_hash.duration", unit="ms", description="Время хеширования и проверки пароля с ожиданием в очереди"
+)
+hash_queue_depth = meter.create_up_down_counter(
+    "auth.password_hash.queue_depth", description="Операции хеширования в очереди и в работе"
+)
+
+
+@lru_cache()
+def get_policy_method(method: str) -> str:
+    """Полная запись метода, как её сохраняет werkzeug (pbkdf2 -> pbkdf2:sha256:1000000)."""
+    return generate_password_hash("", method=method, salt_length=1).split("$", 1)[0]
+
+
+def hash_password(password: str, method: str, salt_length: int) -> str:
+    """Хеш пароля по политике."""
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+
+def hash_passwords(passwords: List[str], method: str, salt_length: int) -> List[str]:
+    """Хеши пачки паролей - одна задача пула на пачку вместо задачи на пароль."""
+    return [hash_password(password, method, salt_length) for password in passwords]
+
+
+def verify_password(password_hash: str, password: str, method: str, salt_length: int) -> Tuple[bool, Optional[str]]:
+    """Сверка пароля и новый хеш, если сохранённый не соответствует политике."""
+    if not check_password_hash(password_hash, password):
+        return False, None
+    if password_hash.split("$", 1)[0] == get_policy_method(method):
+        return True, None
+    return True, hash_password(password, method, salt_length)
+
+
+class PasswordHasher:
+    """
+    Хеширование паролей в пуле процессов.
+
+    scrypt/pbkdf2 занимают CPU на десятки миллисекунд, поэтому выполняются вне event loop.
+    Очередь ограничена: при переполнении запрос отклоняется с 503, а не копится в памяти.
+    """
+
+    def __init__(self, workers: int, max_queue: int, method: str, salt_length: int) -> None:
+        """Инит."""
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.max_queue = max_queue
+        self.pending = 0
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self) -> None:
+        """Запуск пула процессов."""
+        if self.executor is None and self.workers > 0:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def shutdown(self) -> None:
+        """Остановка пула процессов."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+    async def _run(self, operation: str, func: Callable, *args: Any) -> Any:
+        """Выполнение операции в пуле с учётом очереди."""
+        if self.pending >= self.max_queue:
+            logger.warning("Password hash queue is full: %s", self.pending)
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Сервис перегружен")
+        self.start()
+        self.pending += 1
+        hash_queue_depth.add(1)
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+            hash_queue_depth.add(-1)
+            hash_duration.record((time.perf_counter() - started) * 1000, {"operation": operation})
+
+    async def hash(self, password: str) -> str:
+        """Хеш пароля."""
+        return await self._run("hash", hash_password, password, self.method, self.salt_length)
+
+    async def verify(self, password_hash: Optional[str], password: str) -> bool:
+        """Сверка пароля с хешем."""
+        if not password_hash:
+            return False
+        return await self._run("verify", check_password_hash, password_hash, password)
+
+    async def verify_and_update(self, password_hash: Optional[str], password: str) -> Tuple[bool, Optional[str]]:
+        """
+        Сверка пароля с хешем и перехеширование по текущей политике.
+
+        Вторым значением возвращается новый хеш, если сохранённый посчитан с другими параметрами.
+        """
+        if not password_hash:
+            return False, None
+        return await self._run("verify", verify_password, password_hash, password, self.method, self.salt_length)
+
+
+password_hasher = PasswordHasher(
+    workers=settings.password_hash_workers,
+    max_queue=settings.password_hash_queue_size,
+    method=settings.password_hash_method,
+    salt_length=settings.password_salt_length,
+)
@@ -0,0 +1,94 @@
+"""Ключи подписи JWT."""
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from jose import JWTError, jwk, jwt
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class KeyRing:
+    """
+    Набор ключей подписи.
+
+    Для HS* используется общий секрет. Для асимметричных алгоритмов (RS*, ES*) ключи
+    читаются из директории settings.jwt_keys_dir: файл <kid>.pem с приватным ключом.
+    Подписываем активным ключом, проверяем любым опубликованным - так работает ротация:
+    новый ключ добавляется и становится активным, старый удаляется после истечения его токенов.
+    """
+
+    def __init__(
+        self, algorithm: str, secret_key: str, keys_dir: Optional[str] = None, active_kid: Optional[str] = None
+    ) -> None:
+        """Инит."""
+        self.algorithm = algorithm
+        self.secret_key = secret_key
+        self.private_keys: Dict[str, str] = {}
+        self.public_keys: Dict[str, Any] = {}
+        if self.is_symmetric:
+            self.active_kid = None
+            return
+        if not keys_dir:
+            raise ValueError(f"JWT_KEYS_DIR is required for {algorithm}")
+        for path in sorted(Path(keys_dir).glob("*.pem")):
+            private_key = path.read_text()
+            self.private_keys[path.stem] = private_key
+            self.public_keys[path.stem] = jwk.construct(private_key, algorithm).public_key()
+        if not self.private_keys:
+            raise ValueError(f"No signing keys found in {keys_dir}")
+        self.active_kid = active_kid or sorted(self.private_keys)[-1]
+        if self.active_kid not in self.private_keys:
+            raise ValueError(f"Signing key {self.active_kid} not found in {keys_dir}")
+        logger.info("JWT signing key %s, published keys: %s", self.active_kid, list(self.public_keys))
+
+    @property
+    def is_symmetric(self) -> bool:
+        """Подпись общим секретом."""
+        return self.algorithm.startswith("HS")
+
+    def signing_key(self) -> Tuple[Optional[str], Any]:
+        """Ключ для подписи и его kid."""
+        if self.is_symmetric:
+            return None, self.secret_key
+        return self.active_kid, self.private_keys[self.active_kid]
+
+    def verification_key(self, kid: Optional[str]) -> Any:
+        """Ключ для проверки подписи по kid."""
+        if self.is_symmetric:
+            return self.secret_key
+        if kid not in self.public_keys:
+            raise JWTError(f"Unknown key id: {kid}")
+        return self.public_keys[kid]
+
+    def jwks(self) -> Dict[str, List[Dict]]:
+        """Публичные ключи в формате JWKS."""
+        keys = []
+        for kid, public_key in self.public_keys.items():
+            key = public_key.to_dict()
+            key.update({"kid": kid, "use": "sig", "alg": self.algorithm})
+            keys.append(key)
+        return {"keys": keys}
+
+
+key_ring = KeyRing(
+    algorithm=settings.algorithm,
+    secret_key=settings.secret_key,
+    keys_dir=settings.jwt_keys_dir,
+    active_kid=settings.jwt_active_kid,
+)
+
+
+def encode_jwt(claims: Dict) -> str:
+    """Подпись токена активным ключом."""
+    kid, key = key_ring.signing_key()
+    headers = {"kid": kid} if kid else None
+    return jwt.encode(claims, key, settings.algorithm, headers=headers)
+
+
+def decode_jwt(token: str) -> Dict:
+    """Проверка подписи токена ключом из заголовка kid."""
+    kid = jwt.get_unverified_header(token).get("kid")
+    return jwt.decode(token, key_ring.verification_key(kid), algorithms=[settings.algorithm])
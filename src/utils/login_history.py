@@ -0,0 +1,136 @@
+"""Отложенная запись истории входов."""
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from datetime import UTC, datetime
+from typing import Deque, Dict, List, Optional
+
+from opentelemetry.metrics import CallbackOptions, Observation
+from sqlalchemy.ext.asyncio.session import AsyncSession
+
+from core.config import settings
+from core.metrics import meter
+from crud.login_history import DBLoginHistory
+from db.postgres import primary_session
+
+logger = logging.getLogger(__name__)
+
+flush_duration = meter.create_histogram(
+    "auth.login_history.flush.duration", unit="ms", description="Время записи пачки истории входов"
+)
+flush_rows = meter.create_counter("auth.login_history.flush.rows", description="Записано строк истории входов")
+flush_errors = meter.create_counter("auth.login_history.flush.errors", description="Неудачные записи пачек")
+dropped_rows = meter.create_counter(
+    "auth.login_history.dropped", description="Строки, отброшенные из-за переполнения буфера"
+)
+
+
+class LoginHistoryWriter:
+    """
+    Буфер истории входов.
+
+    Строки копятся в памяти и пишутся одним многострочным INSERT раз в flush_interval_ms
+    или по набору batch_size строк, поэтому выдача токенов не ждёт записи в партиционированную таблицу.
+    Пока писатель не запущен (например, без lifespan), строка пишется сразу в сессии запроса.
+    """
+
+    def __init__(self, flush_interval_ms: int, batch_size: int, max_buffer: int) -> None:
+        """Инит."""
+        self.flush_interval = flush_interval_ms / 1000
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        # При переполнении deque сам вытесняет самую старую строку за O(1)
+        self.buffer: Deque[Dict] = deque(maxlen=max_buffer)
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        meter.create_observable_gauge(
+            "auth.login_history.buffer_size",
+            callbacks=[self.observe_buffer],
+            description="Строки истории входов, ожидающие записи",
+        )
+
+    def observe_buffer(self, options: CallbackOptions) -> List[Observation]:
+        """Размер буфера для метрик."""
+        return [Observation(len(self.buffer))]
+
+    @property
+    def is_running(self) -> bool:
+        """Фоновая запись запущена."""
+        return self.task is not None and not self.task.done()
+
+    def start(self) -> None:
+        """Запуск фоновой записи."""
+        if self.is_running:
+            return
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Остановка с дозаписью буфера."""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        while self.buffer:
+            if not await self.flush():
+                logger.error("Login history lost on shutdown: %s rows", len(self.buffer))
+                self.buffer.clear()
+
+    async def write(self, db: AsyncSession, user_id: uuid.UUID, user_agent: Optional[str], host: Optional[str]) -> None:
+        """Постановка записи о входе в очередь."""
+        row = {
+            "id": uuid.uuid4(),
+            "user_id": user_id,
+            "user_agent": user_agent,
+            "host": host,
+            "created_at": datetime.now(UTC),
+        }
+        if not self.is_running:
+            await DBLoginHistory.bulk_insert(db=db, rows=[row])
+            return
+        if len(self.buffer) >= self.max_buffer:
+            dropped_rows.add(1)
+        self.buffer.append(row)
+        if len(self.buffer) >= self.batch_size:
+            self.wakeup.set()
+
+    async def run(self) -> None:
+        """Цикл записи по таймеру или по размеру пачки."""
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            while self.buffer:
+                if not await self.flush() or len(self.buffer) < self.batch_size:
+                    break
+
+    async def flush(self) -> bool:
+        """Запись одной пачки; при ошибке строки возвращаются в буфер."""
+        rows = [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+        start = time.perf_counter()
+        try:
+            async with primary_session() as db:
+                await DBLoginHistory.bulk_insert(db=db, rows=rows)
+        except Exception:
+            logger.exception("Login history flush failed: %s rows", len(rows))
+            flush_errors.add(1)
+            self.buffer.extendleft(reversed(rows[: max(self.max_buffer - len(self.buffer), 0)]))
+            return False
+        finally:
+            flush_duration.record((time.perf_counter() - start) * 1000)
+        flush_rows.add(len(rows))
+        return True
+
+
+login_history_writer = LoginHistoryWriter(
+    flush_interval_ms=settings.login_history_flush_interval_ms,
+    batch_size=settings.login_history_batch_size,
+    max_buffer=settings.login_history_buffer_size,
+)
@@ -0,0 +1,195 @@
+"""Матрица пермишенов роль × раздел в памяти."""
+import asyncio
+import logging
+import time
+import uuid
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from core.config import settings
+from db.postgres import primary_session
+from models.entity import Permission, Section
+from schemas.entity import PermissionUserSchema, SectionViewSchema
+
+logger = logging.getLogger(__name__)
+
+CAN_VIEW = 1
+CAN_EDIT = 2
+CAN_DELETE = 4
+
+# Значение section_names для проверки по всем разделам
+ALL_SECTIONS = "all"
+
+INVALIDATE_CHANNEL = "permissions:invalidate"
+LISTEN_TIMEOUT = 30
+
+
+class PermissionIndex(NamedTuple):
+    """Снимок разделов и масок пермишенов по (роль, раздел)."""
+
+    sections: Dict[str, SectionViewSchema]
+    masks: Dict[Tuple[uuid.UUID, uuid.UUID], int]
+
+
+def to_mask(permission: Permission) -> int:
+    """Битовая маска флагов пермишена."""
+    return (
+        (CAN_VIEW if permission.can_view else 0)
+        | (CAN_EDIT if permission.can_edit else 0)
+        | (CAN_DELETE if permission.can_delete else 0)
+    )
+
+
+class PermissionMatrix:
+    """
+    Индекс пермишенов в памяти.
+
+    Загружается при старте двумя запросами из основной базы и заменяется целиком. RoleService
+    и SectionService после изменений публикуют сообщение в канал редиса, по которому каждый воркер
+    перечитывает индекс. Индекс старше max_age секунд перечитывается при обращении, поэтому
+    потерянное сообщение (переподключение к редису) не оставляет воркер со старой матрицей.
+    Без lifespan (тесты) индекс читается лениво из переданной фабрики сессий основной базы.
+    """
+
+    def __init__(self, max_age: float) -> None:
+        """Инит."""
+        self.max_age = max_age
+        self.index: Optional[PermissionIndex] = None
+        self.loaded_at = float("-inf")
+        self.lock = asyncio.Lock()
+        self.listener: Optional[asyncio.Task] = None
+
+    @staticmethod
+    async def build(db: AsyncSession) -> PermissionIndex:
+        """Чтение разделов и пермишенов из базы."""
+        sections = (await db.execute(select(Section.id, Section.name))).all()
+        permissions = (await db.execute(select(Permission))).scalars().all()
+        masks: Dict[Tuple[uuid.UUID, uuid.UUID], int] = {}
+        for permission in permissions:
+            key = (permission.role_id, permission.section_id)
+            masks[key] = masks.get(key, 0) | to_mask(permission)
+        return PermissionIndex(
+            sections={name: SectionViewSchema(id=_id, name=name) for _id, name in sections},
+            masks=masks,
+        )
+
+    def is_fresh(self) -> bool:
+        """Индекс загружен и не старше max_age."""
+        return self.index is not None and time.monotonic() - self.loaded_at < self.max_age
+
+    async def reload(self, sessions: async_sessionmaker = primary_session, stale_only: bool = False) -> PermissionIndex:
+        """Перечитывание индекса; stale_only - только если его не успел обновить конкурентный вызов."""
+        async with self.lock:
+            if stale_only and self.is_fresh():
+                return self.index
+            loaded_at = time.monotonic()
+            async with sessions() as db:
+                index = await self.build(db)
+            self.index, self.loaded_at = index, loaded_at
+        logger.info("Permission matrix loaded: %s sections, %s grants", len(index.sections), len(index.masks))
+        return index
+
+    async def get(self, sessions: async_sessionmaker) -> PermissionIndex:
+        """Текущий индекс; отсутствующий или устаревший читается сессией основной базы из sessions."""
+        index = self.index
+        if not self.is_fresh():
+            index = await self.reload(sessions, stale_only=True)
+        return index
+
+    @staticmethod
+    def merge(index: PermissionIndex, section: SectionViewSchema, role_ids: List[uuid.UUID]) -> Optional[int]:
+        """Объединённая по ролям маска раздела; None, если ни у одной роли нет пермишена."""
+        mask = None
+        for role_id in role_ids:
+            value = index.masks.get((role_id, section.id))
+            if value is not None:
+                mask = (mask or 0) | value
+        return mask
+
+    @staticmethod
+    def to_schema(section: SectionViewSchema, mask: int) -> PermissionUserSchema:
+        """Флаги пермишена по маске."""
+        return PermissionUserSchema(
+            section=section,
+            can_view=bool(mask & CAN_VIEW),
+            can_edit=bool(mask & CAN_EDIT),
+            can_delete=bool(mask & CAN_DELETE),
+        )
+
+    async def check(
+        self, sessions: async_sessionmaker, section_name: str, role_ids: Iterable[uuid.UUID]
+    ) -> Tuple[Optional[SectionViewSchema], Optional[PermissionUserSchema]]:
+        """Раздел и объединённые по ролям флаги; флагов нет, если ни у одной роли нет пермишена."""
+        index = await self.get(sessions)
+        section = index.sections.get(section_name)
+        if section is None:
+            return None, None
+        mask = self.merge(index, section, list(role_ids))
+        if mask is None:
+            return section, None
+        return section, self.to_schema(section, mask)
+
+    async def check_many(
+        self, sessions: async_sessionmaker, section_names: Optional[Iterable[str]], role_ids: Iterable[uuid.UUID]
+    ) -> Tuple[List[PermissionUserSchema], List[str]]:
+        """Флаги по каждому разделу (None - по всем) и список неизвестных разделов; без пермишенов флаги ложны."""
+        index = await self.get(sessions)
+        role_ids = list(role_ids)
+        names = sorted(index.sections) if section_names is None else list(dict.fromkeys(section_names))
+        permissions, missing = [], []
+        for name in names:
+            section = index.sections.get(name)
+            if section is None:
+                missing.append(name)
+                continue
+            permissions.append(self.to_schema(section, self.merge(index, section, role_ids) or 0))
+        return permissions, missing
+
+    async def invalidate(self, cache: Redis) -> None:
+        """Сброс индекса в этом воркере и оповещение остальных."""
+        self.index = None
+        self.loaded_at = float("-inf")
+        try:
+            await cache.publish(INVALIDATE_CHANNEL, "1")
+        except RedisError:
+            logger.exception("Permission matrix invalidation was not published")
+
+    async def start(self, cache: Redis) -> None:
+        """Загрузка индекса и подписка на инвалидацию."""
+        await self.reload()
+        self.listener = asyncio.create_task(self.listen(cache))
+
+    async def stop(self) -> None:
+        """Остановка подписки."""
+        if self.listener is not None:
+            self.listener.cancel()
+            self.listener = None
+
+    async def listen(self, cache: Redis) -> None:
+        """Перечитывание индекса по сообщениям; после переподключения - безусловно, сообщения могли потеряться."""
+        while True:
+            pubsub = cache.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(INVALIDATE_CHANNEL)
+                if self.index is None:
+                    await self.reload()
+                while True:
+                    # Явный таймаут чтения: socket_timeout пула разорвал бы подписку в тишине
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=LISTEN_TIMEOUT)
+                    if message is not None:
+                        await self.reload()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Permission matrix listener failed, resubscribing")
+                self.index = None
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+
+permission_matrix = PermissionMatrix(max_age=settings.permission_matrix_max_age_s)
@@ -1,24 +1,345 @@
 """Ограничитель запросов."""
+import asyncio
+import logging
+import math
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
-import datetime
-
-import redis
+from fastapi import Request
+from fastapi.security.utils import get_authorization_scheme_param
+from jose import JWTError
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
 
 from core.config import settings
+from core.metrics import meter
+from utils.auth import decode_access_token
+
+logger = logging.getLogger(__name__)
+
+rate_limit_decisions = meter.create_counter(
+    "auth.rate_limit.decisions", description="Решения ограничителя запросов по результату"
+)
+
+# GCRA по нескольким ключам сразу: запрос пропускается, только если его пропускают все политики.
+# KEYS: ключи политик. ARGV: стоимость запроса, число запросов, уже пропущенных локально (списываются
+# безусловно), затем пары (интервал между запросами, допуск) в мс.
+# Возвращает {пропущен, остаток, retry_after мс, reset_after мс, номер определяющей политики}.
+GCRA_SCRIPT = """
+local cost = tonumber(ARGV[1])
+local settled = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local allowed = 1
+local binding = 1
+local remaining = nil
+local retry_after = 0
+local reset_after = 0
+local new_tats = {}
+local settled_tats = {}
+for i, key in ipairs(KEYS) do
+    local emission = tonumber(ARGV[i * 2 + 1])
+    local tolerance = tonumber(ARGV[i * 2 + 2])
+    local tat = math.max(tonumber(redis.call('GET', key) or now), now) + emission * settled
+    local new_tat = tat + emission * cost
+    local diff = now - (new_tat - tolerance)
+    if diff < 0 and cost > 0 then
+        if allowed == 1 or -diff > retry_after then
+            binding = i
+            retry_after = -diff
+            reset_after = tat - now
+        end
+        allowed = 0
+        remaining = 0
+    elseif allowed == 1 then
+        local left = math.max(math.floor(diff / emission), 0)
+        if remaining == nil or left < remaining then
+            remaining = left
+            binding = i
+            reset_after = new_tat - now
+        end
+    end
+    new_tats[i] = new_tat
+    settled_tats[i] = tat
+end
+if allowed == 1 or settled > 0 then
+    for i, key in ipairs(KEYS) do
+        local value = allowed == 1 and new_tats[i] or settled_tats[i]
+        redis.call('SET', key, value, 'PX', math.ceil(value - now))
+    end
+end
+return {allowed, remaining or 0, retry_after, reset_after, binding}
+"""
+
+
+class RateLimitPolicy(NamedTuple):
+    """Политика: limit запросов за period секунд."""
+
+    name: str
+    limit: int
+    period: float
+
+    @classmethod
+    def parse(cls, name: str, value: str) -> "RateLimitPolicy":
+        """Политика из строки вида 100/60."""
+        limit, period = value.split("/")
+        return cls(name=name, limit=int(limit), period=float(period))
+
+    @property
+    def emission_interval_ms(self) -> float:
+        """Интервал между запросами при равномерной нагрузке."""
+        return self.period * 1000 / self.limit
+
+    @property
+    def tolerance_ms(self) -> float:
+        """Допуск GCRA: разрешает всплеск в limit запросов."""
+        return self.period * 1000
+
+
+class RateLimitResult(NamedTuple):
+    """Решение ограничителя."""
+
+    allowed: bool
+    policy: RateLimitPolicy
+    remaining: int
+    retry_after: float
+    reset_after: float
+
+    def headers(self) -> Dict[str, str]:
+        """Заголовки X-RateLimit-* и Retry-After."""
+        headers = {
+            "X-RateLimit-Limit": str(self.policy.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(math.ceil(self.reset_after)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(math.ceil(self.retry_after))
+        return headers
+
+
+class LocalBucket:
+    """Локальное состояние набора ключей: последний ответ редиса и пропущенные без него запросы."""
+
+    __slots__ = ("policies", "result", "pending", "synced_at")
+
+    def __init__(self, policies: List[Tuple[str, RateLimitPolicy]]) -> None:
+        """Инит."""
+        self.policies = policies
+        self.result: Optional[RateLimitResult] = None
+        self.pending = 0
+        self.synced_at = 0.0
+
+
+class RateLimiter:
+    """
+    Ограничитель запросов на GCRA в Lua скрипте.
+
+    В отличие от фиксированных минутных окон GCRA не пропускает двойной всплеск на границе минуты.
+    Проверка идёт до вызова ручки. Каждый запрос проверяется политикой субъекта
+    (аноним по IP, пользователь или его роль) и, если путь совпал, политикой маршрута.
+    Все политики проверяются за один вызов редиса. Клиент редиса создаётся в lifespan;
+    до запуска (например, в тестах без lifespan) запросы не ограничиваются.
+
+    Перед редисом стоит локальный фильтр: пока ключ далеко от квоты, решения принимаются в памяти,
+    а пропущенные запросы списываются в редис при следующем обращении или фоновой сверке.
+    local_batch = 0 отключает фильтр.
+    """
+
+    def __init__(
+        self,
+        default: RateLimitPolicy,
+        principals: Dict[str, RateLimitPolicy],
+        routes: Dict[str, RateLimitPolicy],
+        local_batch: int = 0,
+        local_sync_interval: float = 1,
+    ) -> None:
+        """Инит."""
+        self.local_batch = local_batch
+        self.local_sync_interval = local_sync_interval
+        self.buckets: Dict[Tuple[str, ...], LocalBucket] = {}
+        self.reconcile_task: Optional[asyncio.Task] = None
+        self.default = default
+        self.principals = principals
+        self.routes = sorted(routes.items(), key=lambda item: len(item[0]), reverse=True)
+        self.cache: Optional[Redis] = None
+        self.script = None
+
+    @classmethod
+    def from_settings(cls) -> "RateLimiter":
+        """Ограничитель по настройкам."""
+        return cls(
+            default=RateLimitPolicy(name="default", limit=settings.request_limit_per_minute, period=60),
+            principals={
+                name: RateLimitPolicy.parse(name, value) for name, value in settings.rate_limit_principals.items()
+            },
+            routes={route: RateLimitPolicy.parse(route, value) for route, value in settings.rate_limit_routes.items()},
+            local_batch=settings.rate_limit_local_batch,
+            local_sync_interval=settings.rate_limit_local_sync_ms / 1000,
+        )
+
+    def start(self, cache: Redis) -> None:
+        """Подключение к редису."""
+        self.cache = cache
+        self.script = self.cache.register_script(GCRA_SCRIPT)
+        if self.local_batch:
+            self.reconcile_task = asyncio.create_task(self.reconcile_loop())
+
+    async def stop(self) -> None:
+        """Списание локальных запросов и закрытие подключения."""
+        if self.reconcile_task is not None:
+            self.reconcile_task.cancel()
+            self.reconcile_task = None
+            try:
+                await self.reconcile()
+            except RedisError:
+                logger.exception("Rate limiter reconciliation failed")
+        self.buckets.clear()
+        if self.cache is not None:
+            await self.cache.aclose()
+        self.cache = None
+        self.script = None
+
+    def principal_policy(self, payload: Optional[Dict]) -> RateLimitPolicy:
+        """Политика субъекта: самая щедрая из ролей, затем user или anonymous."""
+        if payload is None:
+            return self.principals.get("anonymous", self.default)
+        role_policies = [self.principals[name] for name in payload.get("role_names", []) if name in self.principals]
+        if role_policies:
+            return max(role_policies, key=lambda policy: policy.limit / policy.period)
+        return self.principals.get("user", self.default)
+
+    def route_policy(self, method: str, path: str) -> Optional[RateLimitPolicy]:
+        """Политика маршрута по самому длинному совпавшему префиксу, с методом или без."""
+        for route, policy in self.routes:
+            route_method, _, route_path = route.rpartition(" ")
+            if route_method and route_method.upper() != method:
+                continue
+            if path.startswith(route_path):
+                return policy
+        return None
+
+    def policies(self, request: Request) -> List[Tuple[str, RateLimitPolicy]]:
+        """Ключи и политики запроса."""
+        payload = get_request_payload(request)
+        subject = f"user:{payload['sub']}" if payload else f"ip:{get_client_ip(request)}"
+        policy = self.principal_policy(payload)
+        policies = [(f"rate_limit:{policy.name}:{subject}", policy)]
+        route_policy = self.route_policy(request.method, request.url.path)
+        if route_policy:
+            policies.append((f"rate_limit:route:{route_policy.name}:{subject}", route_policy))
+        return policies
+
+    async def check(
+        self, policies: List[Tuple[str, RateLimitPolicy]], cost: int = 1, settled: int = 0
+    ) -> RateLimitResult:
+        """Проверка и списание запроса по всем политикам разом вместе с локально пропущенными."""
+        args = [cost, settled]
+        for _, policy in policies:
+            args.extend([policy.emission_interval_ms, policy.tolerance_ms])
+        allowed, remaining, retry_after, reset_after, binding = await self.script(
+            keys=[key for key, _ in policies], args=args
+        )
+        return RateLimitResult(
+            allowed=bool(allowed),
+            policy=policies[int(binding) - 1][1],
+            remaining=int(remaining),
+            retry_after=float(retry_after) / 1000,
+            reset_after=float(reset_after) / 1000,
+        )
+
+    def local_decision(self, bucket: Optional[LocalBucket]) -> Optional[RateLimitResult]:
+        """
+        Пропуск запроса без редиса.
+
+        Локально пропускаем, пока последний ответ редиса свежее local_sync_interval, несписанных запросов
+        меньше local_batch и до исчерпания квоты остаётся больше local_batch запросов.
+        Поэтому один инстанс превышает лимит не больше чем на local_batch запросов.
+        """
+        if (
+            bucket is None
+            or bucket.result is None
+            or not bucket.result.allowed
+            or time.monotonic() - bucket.synced_at >= self.local_sync_interval
+            or bucket.pending >= self.local_batch
+            or bucket.result.remaining - bucket.pending <= self.local_batch
+        ):
+            return None
+        bucket.pending += 1
+        return bucket.result._replace(remaining=bucket.result.remaining - bucket.pending)
+
+    async def sync(self, bucket: LocalBucket, cost: int) -> RateLimitResult:
+        """Списание локально пропущенных запросов и, при cost > 0, проверка текущего."""
+        settled, bucket.pending = bucket.pending, 0
+        try:
+            result = await self.check(bucket.policies, cost=cost, settled=settled)
+        except Exception:
+            bucket.pending += settled
+            raise
+        bucket.result = result
+        bucket.synced_at = time.monotonic()
+        return result
+
+    async def limit(self, request: Request) -> Optional[RateLimitResult]:
+        """Решение по запросу; None, если ограничитель не запущен или редис недоступен."""
+        if self.script is None:
+            return None
+        policies = self.policies(request)
+        key = tuple(key for key, _ in policies)
+        bucket = self.buckets.get(key) if self.local_batch else None
+        result = self.local_decision(bucket)
+        if result is not None:
+            rate_limit_decisions.add(1, {"allowed": True, "policy": result.policy.name, "tier": "local"})
+            return result
+        if bucket is None:
+            bucket = LocalBucket(policies)
+            if self.local_batch:
+                self.buckets[key] = bucket
+        try:
+            result = await self.sync(bucket, cost=1)
+        except RedisError:
+            logger.exception("Rate limiter unavailable, request allowed")
+            return None
+        rate_limit_decisions.add(1, {"allowed": result.allowed, "policy": result.policy.name, "tier": "redis"})
+        return result
+
+    async def reconcile(self) -> None:
+        """Списание несписанных локальных запросов и удаление давно не используемых ключей."""
+        now = time.monotonic()
+        for key, bucket in list(self.buckets.items()):
+            if bucket.pending:
+                await self.sync(bucket, cost=0)
+            elif now - bucket.synced_at > self.local_sync_interval * 10:
+                del self.buckets[key]
+
+    async def reconcile_loop(self) -> None:
+        """Периодическая сверка с редисом."""
+        while True:
+            await asyncio.sleep(self.local_sync_interval)
+            try:
+                await self.reconcile()
+            except RedisError:
+                logger.exception("Rate limiter reconciliation failed")
+
+
+def get_client_ip(request: Request) -> str:
+    """IP клиента с учётом прокси."""
+    forwarded = request.headers.get("X-Forwarded-For")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def get_request_payload(request: Request) -> Optional[Dict]:
+    """Проверенные клеймы аксесс токена; сохраняются в request.state для зависимостей авторизации."""
+    scheme, token = get_authorization_scheme_param(request.headers.get("Authorization"))
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        payload = decode_access_token(token)
+    except JWTError:
+        return None
+    request.state.token_payload = payload
+    return payload
+
 
-redis_conn = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=1)
-
-
-def rate_limiter(user):
-    """Ограничитель запросов."""
-    pipe = redis_conn.pipeline()
-    now = datetime.datetime.now()
-    key = f"{user}:{now.minute}"
-    pipe.incr(key)
-    pipe.expire(key, settings.exp_rate_limiter)
-    result = pipe.execute()
-    request_number = result[0]
-    if request_number > settings.request_limit_per_minute:
-        return True
-    else:
-        return False
+rate_limiter = RateLimiter.from_settings()
@@ -0,0 +1,44 @@
+"""Схлопывание одинаковых конкурентных запросов."""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from core.metrics import meter
+
+singleflight_calls = meter.create_counter(
+    "auth.singleflight.calls", description="Вызовы через singleflight: shared - дождались чужого запроса"
+)
+
+
+class SingleFlight:
+    """
+    Один запрос на ключ в полёте.
+
+    Первый вызов по ключу запускает call отдельной задачей, он и конкурентные вызовы с тем же ключом
+    ждут её результат или исключение. Отмена любого из ожидающих задачу не отменяет. После завершения
+    задачи ключ освобождается, результат не кешируется.
+    """
+
+    def __init__(self, name: str) -> None:
+        """Инит."""
+        self.name = name
+        self.calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Результат call, общий для конкурентных вызовов с одним ключом."""
+        task = self.calls.get(key)
+        singleflight_calls.add(1, {"name": self.name, "shared": task is not None})
+        if task is None:
+            # Вызов живёт в своей задаче: отмена первого вызывающего не отменяет его для остальных
+            task = asyncio.ensure_future(call())
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self.forget(key, done))
+        # shield: отмена ожидающего не должна отменять общий вызов
+        return await asyncio.shield(task)
+
+    def forget(self, key: Hashable, task: asyncio.Task) -> None:
+        """Освобождение ключа по завершении вызова."""
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            # Помечаем исключение полученным, если все ожидающие ушли
+            task.exception()
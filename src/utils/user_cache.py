@@ -0,0 +1,191 @@
+"""Кеш пользователя с ролями для RPC me."""
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from core.config import settings
+from core.metrics import meter
+from db.redis import register_script
+from schemas.entity import UserRoleSchema
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_KEY = "user_me:{user_id}"
+USER_CACHE_GENERATION_KEY = "user_me_generation:{user_id}"
+
+# KEYS - пары (ключ пользователя, ключ поколения); ARGV[1] - ttl, дальше пары (поколение на начало чтения, значение).
+# Запись только если поколение не сменилось, то есть между чтением базы и записью не было инвалидации
+SET_IF_GENERATION_SCRIPT = """
+local stored = {}
+for i = 1, #KEYS, 2 do
+    if (redis.call('GET', KEYS[i + 1]) or '') == ARGV[i + 1] then
+        redis.call('SET', KEYS[i], ARGV[i + 2], 'EX', ARGV[1])
+        stored[#stored + 1] = 1
+    else
+        stored[#stored + 1] = 0
+    end
+end
+return stored
+"""
+set_if_generation_script = register_script(SET_IF_GENERATION_SCRIPT)
+
+user_cache_lookups = meter.create_counter(
+    "auth.user_cache.lookups", description="Обращения к кешу пользователя по уровню ответа: local, redis, miss"
+)
+
+
+class UserCache:
+    """
+    Сериализованный UserRoleSchema по id пользователя.
+
+    Основная копия лежит в редисе на ttl секунд, перед ним - LRU в памяти воркера на local_ttl секунд.
+    Запись пользователя или его ролей удаляет ключ в редисе и локальную копию и сдвигает поколение
+    пользователя; копии в других воркерах живут не дольше local_ttl. Заполнение запоминает поколения
+    до чтения базы и пишет только тех, чьё поколение не сменилось, поэтому чтение, начатое до
+    инвалидации, не перезапишет её старыми данными.
+    """
+
+    def __init__(self, ttl: int, local_ttl: float, local_size: int) -> None:
+        """Инит."""
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.local_size = local_size
+        self.local: OrderedDict[str, Tuple[float, UserRoleSchema]] = OrderedDict()
+
+    def get_local(self, key: str) -> Optional[UserRoleSchema]:
+        """Копия из памяти, если не истекла."""
+        item = self.local.get(key)
+        if item is None:
+            return None
+        expires_at, user = item
+        if expires_at < time.monotonic():
+            del self.local[key]
+            return None
+        self.local.move_to_end(key)
+        return user
+
+    def set_local(self, key: str, user: UserRoleSchema) -> None:
+        """Сохранение копии в памяти."""
+        if not self.local_size or not self.local_ttl:
+            return
+        self.local[key] = (time.monotonic() + self.local_ttl, user)
+        self.local.move_to_end(key)
+        if len(self.local) > self.local_size:
+            self.local.popitem(last=False)
+
+    async def get(self, cache: Redis, user_id: Union[str, uuid.UUID]) -> Optional[UserRoleSchema]:
+        """Пользователь из кеша; None - нужно читать базу."""
+        key = USER_CACHE_KEY.format(user_id=user_id)
+        user = self.get_local(key)
+        if user is not None:
+            user_cache_lookups.add(1, {"result": "local"})
+            return user
+        try:
+            raw = await cache.get(key)
+        except RedisError:
+            logger.exception("User cache read failed")
+            raw = None
+        if raw is None:
+            user_cache_lookups.add(1, {"result": "miss"})
+            return None
+        user = UserRoleSchema.model_validate_json(raw)
+        self.set_local(key, user)
+        user_cache_lookups.add(1, {"result": "redis"})
+        return user
+
+    async def get_many(
+        self, cache: Redis, user_ids: Iterable[Union[str, uuid.UUID]]
+    ) -> Dict[uuid.UUID, UserRoleSchema]:
+        """Найденные в кеше пользователи: сначала память, остальные одним MGET."""
+        found: Dict[uuid.UUID, UserRoleSchema] = {}
+        remote = []
+        for user_id in user_ids:
+            user = self.get_local(USER_CACHE_KEY.format(user_id=user_id))
+            if user is None:
+                remote.append(user_id)
+            else:
+                found[user.id] = user
+        user_cache_lookups.add(len(found), {"result": "local"})
+        if not remote:
+            return found
+        try:
+            values = await cache.mget([USER_CACHE_KEY.format(user_id=user_id) for user_id in remote])
+        except RedisError:
+            logger.exception("User cache read failed")
+            values = [None] * len(remote)
+        hits = 0
+        for raw in values:
+            if raw is None:
+                continue
+            user = UserRoleSchema.model_validate_json(raw)
+            self.set_local(USER_CACHE_KEY.format(user_id=user.id), user)
+            found[user.id] = user
+            hits += 1
+        user_cache_lookups.add(hits, {"result": "redis"})
+        user_cache_lookups.add(len(remote) - hits, {"result": "miss"})
+        return found
+
+    async def generations(self, cache: Redis, user_ids: Iterable[Union[str, uuid.UUID]]) -> Optional[Dict[str, str]]:
+        """Поколения пользователей перед чтением базы; None - редис недоступен и заполнять кеш нельзя."""
+        user_ids = [str(user_id) for user_id in user_ids]
+        try:
+            values = await cache.mget([USER_CACHE_GENERATION_KEY.format(user_id=user_id) for user_id in user_ids])
+        except RedisError:
+            logger.exception("User cache read failed")
+            return None
+        return {
+            user_id: (value.decode() if isinstance(value, bytes) else value) or ""
+            for user_id, value in zip(user_ids, values)
+        }
+
+    async def set(self, cache: Redis, user: UserRoleSchema, generations: Optional[Dict[str, str]]) -> None:
+        """Сохранение пользователя в кеш, если его не инвалидировали с момента generations."""
+        await self.set_many(cache, [user], generations)
+
+    async def set_many(
+        self, cache: Redis, users: Iterable[UserRoleSchema], generations: Optional[Dict[str, str]]
+    ) -> None:
+        """Сохранение пользователей одним скриптом; пропускаются инвалидированные с момента generations."""
+        users = list(users)
+        if not users or generations is None:
+            return
+        keys, args = [], [self.ttl]
+        for user in users:
+            keys += [USER_CACHE_KEY.format(user_id=user.id), USER_CACHE_GENERATION_KEY.format(user_id=user.id)]
+            args += [generations.get(str(user.id), ""), user.model_dump_json()]
+        try:
+            stored = await set_if_generation_script(keys=keys, args=args, client=cache)
+        except RedisError:
+            logger.exception("User cache write failed")
+            return
+        for user, ok in zip(users, stored):
+            if ok:
+                self.set_local(USER_CACHE_KEY.format(user_id=user.id), user)
+
+    async def invalidate(self, cache: Redis, user_ids: Iterable[Union[str, uuid.UUID]]) -> None:
+        """Удаление пользователей из кеша и сдвиг их поколений."""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        pipe = cache.pipeline(transaction=False)
+        for user_id in user_ids:
+            key = USER_CACHE_KEY.format(user_id=user_id)
+            generation_key = USER_CACHE_GENERATION_KEY.format(user_id=user_id)
+            self.local.pop(key, None)
+            pipe.unlink(key)
+            pipe.incr(generation_key)
+            # Поколение должно пережить любое заполнение, начатое до инвалидации
+            pipe.expire(generation_key, self.ttl)
+        await pipe.execute()
+
+
+user_cache = UserCache(
+    ttl=settings.user_cache_ttl_s,
+    local_ttl=settings.user_cache_local_ttl_s,
+    local_size=settings.user_cache_local_size,
+)